@@ -0,0 +1,97 @@
+"""
+This module features the FakePostgresInteraction() class. The class keeps the
+tables written by the scraper in memory, with an optional delay for each
+round trip, so that the scraper can be benchmarked without a database.
+"""
+
+import threading
+import time
+
+from scraper.node_registry import NodeRegistry
+
+
+class FakePostgresInteraction(object):
+
+    def __init__(self, latency=0.0):
+        """
+        Initializes the fake database with empty tables.
+
+        latency (float): [OPTIONAL] Seconds each round trip is delayed by
+        """
+        self.latency = latency
+        self.round_trips = 0
+        self.node_ids = {}
+        self.messages = []
+        self.last_messages = {}
+        self.buoys = {}
+        self.nodes = NodeRegistry(self)
+        self._lock = threading.Lock()
+
+    def _round_trip(self):
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            self.round_trips += 1
+
+    def retrieve_all_nodes(self):
+        self._round_trip()
+        with self._lock:
+            return [(node_id, sigfox_id, False) for sigfox_id, node_id in self.node_ids.items()]
+
+    def iter_all_nodes(self):
+        return iter(self.retrieve_all_nodes())
+
+    def add_node_returning_id(self, sigfox_id, is_active):
+        self._round_trip()
+        with self._lock:
+            return self.node_ids.setdefault(sigfox_id, len(self.node_ids) + 1)
+
+    def retrieve_latest_message_times(self):
+        self._round_trip()
+        latest_times = {}
+        with self._lock:
+            sigfox_ids = dict((node_id, sigfox_id) for sigfox_id, node_id in self.node_ids.items())
+            for node_id, message, time_sent in self.messages:
+                sigfox_id = sigfox_ids[node_id]
+                latest_times[sigfox_id] = max(time_sent, latest_times.get(sigfox_id, time_sent))
+        return latest_times
+
+    def add_messages(self, rows):
+        self._round_trip()
+        with self._lock:
+            self.messages.extend(rows)
+        return []
+
+    def add_message_batch(self, batch):
+        self._round_trip()
+        with self._lock:
+            self.messages.extend(batch.rows())
+        return []
+
+    def add_latest_message(self, node_id, button_pressed, temperature_sensed, 
+                                vibration_sensed, temperature, vibration, time_sent):
+        self._round_trip()
+        with self._lock:
+            self.last_messages[node_id] = (button_pressed, temperature_sensed,
+                            vibration_sensed, temperature, vibration, time_sent)
+        return True
+
+    def add_latest_messages(self, rows):
+        self._round_trip()
+        with self._lock:
+            for row in rows:
+                self.last_messages[row[0]] = row[1:]
+        return []
+
+    def update_buoy_checked_by_node_id(self, time_checked, node_id, is_there):
+        self._round_trip()
+        with self._lock:
+            self.buoys[node_id] = (time_checked, is_there)
+        return True
+
+    def update_buoys_checked(self, rows):
+        self._round_trip()
+        with self._lock:
+            for node_id, time_checked, is_there in rows:
+                self.buoys[node_id] = (time_checked, is_there)
+        return []
@@ -0,0 +1,223 @@
+"""
+Runs the scraping pipeline against a local Sigfox stub server and reports its
+throughput, along with the latency of each stage. By default the messages are
+written to an in-memory fake database; --postgres writes them to a real one.
+
+    python -m benchmarks.run_benchmark --devices-per-type 100 --latency 0.05
+"""
+
+import argparse
+import threading
+import time
+from contextlib import contextmanager
+
+from benchmarks.fake_db import FakePostgresInteraction
+from benchmarks.sigfox_stub import SigfoxStubServer
+from main_scraper import scrape_messages
+from scraper.database_writer import DatabaseWriter
+from scraper.device_catalog import DeviceCatalog
+from scraper.latest_state import LatestState
+from scraper.postgres_interaction import PostgresInteraction
+from scraper.postgres_interface import close_pools
+from scraper.rate_limiter import RateLimiter
+from scraper.sigfox_parser import SigfoxParser
+from scraper.sigfox_scraper import SigfoxScraper
+
+DB_METHODS = ('add_message_batch', 'add_latest_messages', 'update_buoys_checked',
+                        'add_node_returning_id', 'iter_all_nodes')
+
+
+class StageTimings(object):
+
+    def __init__(self):
+        """
+        Initializes empty timings. Durations are recorded in seconds.
+        """
+        self._durations = {}
+        self._lock = threading.Lock()
+
+    def record(self, stage, seconds):
+        with self._lock:
+            self._durations.setdefault(stage, []).append(seconds)
+
+    def wrap(self, stage, function):
+        """
+        Returns function, timed under the given stage name.
+        """
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.record(stage, time.perf_counter() - start)
+        return timed
+
+    def count(self, stage):
+        with self._lock:
+            return len(self._durations.get(stage, []))
+
+    def summary(self):
+        """
+        Returns a list of (stage, count, p50, p99) tuples, in milliseconds.
+        """
+        rows = []
+        with self._lock:
+            for stage, durations in sorted(self._durations.items()):
+                durations = sorted(durations)
+                rows.append((stage, len(durations), percentile(durations, 0.50) * 1000,
+                                            percentile(durations, 0.99) * 1000))
+        return rows
+
+
+def percentile(sorted_values, fraction):
+    """
+    Returns the value at the given fraction of a sorted list.
+    """
+    if not sorted_values:
+        return 0.0
+    return sorted_values[int(round(fraction * (len(sorted_values) - 1)))]
+
+@contextmanager
+def patched(owner, name, replacement):
+    """
+    Replaces an attribute for the duration of the context.
+    """
+    original = getattr(owner, name)
+    setattr(owner, name, replacement)
+    try:
+        yield
+    finally:
+        setattr(owner, name, original)
+
+def create_database(args):
+    """
+    Returns the database selected by the command line arguments.
+    """
+    if not args.postgres:
+        return FakePostgresInteraction(args.db_latency)
+
+    return PostgresInteraction(args.db_name, args.db_user, args.db_password,
+                                    args.host, pooled=True,
+                                    max_connections=max(args.workers, 1) + 2)
+
+def run(args):
+    """
+    Runs the benchmark described by the command line arguments and returns
+    a dict of the results.
+    """
+    stub = SigfoxStubServer(args.device_types, args.devices_per_type,
+                            args.messages, args.page_size, args.latency)
+    stub.start()
+
+    timings = StageTimings()
+    db = create_database(args)
+    for name in DB_METHODS:
+        setattr(db, name, timings.wrap('db.%s' % name, getattr(db, name)))
+
+    messages_stored = [0]
+    add_message_batch = db.add_message_batch
+    def count_messages(batch):
+        failed = add_message_batch(batch)
+        messages_stored[0] += len(batch) - len(failed)
+        return failed
+    db.add_message_batch = count_messages
+
+    rate_limiter = RateLimiter('benchmark', rate=args.rate or None,
+                    burst=max(args.workers, 1), max_concurrency=max(args.workers, 1),
+                    initial_concurrency=max(args.workers, 1))
+    scraper = SigfoxScraper('benchmark', 'benchmark', pool_size=max(args.workers, 1),
+                                    api_url=stub.api_url, rate_limiter=rate_limiter)
+    catalog = DeviceCatalog(scraper, args.catalog_ttl)
+    latest_times = None
+    if args.incremental:
+        latest_times = db.retrieve_latest_message_times()
+    latest_state = LatestState(db)
+
+    writer = None
+    if args.pipelined:
+        writer = DatabaseWriter(db, latest_state)
+        writer.start()
+
+    parse = SigfoxParser.retrieve_message_batch_from_response
+    get = SigfoxScraper._get
+    with patched(SigfoxScraper, '_get', timings.wrap('http', get)), \
+            patched(SigfoxParser, 'retrieve_message_batch_from_response',
+                                                timings.wrap('parse', parse)):
+        start = time.perf_counter()
+        try:
+            for iteration in range(args.iterations):
+                if iteration:
+                    stub.advance(args.new_messages)
+
+                iteration_start = time.perf_counter()
+                scrape_messages(scraper, db, latest_times, args.workers, catalog,
+                                                                latest_state, writer)
+                if writer is not None:
+                    writer.flush()
+                latest_state.flush()
+                timings.record('iteration', time.perf_counter() - iteration_start)
+        finally:
+            elapsed = time.perf_counter() - start
+            if writer is not None:
+                writer.close()
+            scraper.close()
+            stub.stop()
+            if args.postgres:
+                close_pools()
+
+    return {
+        'elapsed': elapsed,
+        'messages': messages_stored[0],
+        'requests': timings.count('http'),
+        'stages': timings.summary(),
+    }
+
+def print_report(results):
+    """
+    Prints the results of run() as a table.
+    """
+    elapsed = results['elapsed']
+    print("Elapsed:      %.3f s" % elapsed)
+    print("Messages:     %d (%.1f messages/s)" % (results['messages'],
+                                                    results['messages'] / elapsed))
+    print("Requests:     %d (%.1f requests/s)" % (results['requests'],
+                                                    results['requests'] / elapsed))
+    print("")
+    print("%-28s %8s %10s %10s" % ('Stage', 'Count', 'p50 ms', 'p99 ms'))
+    for stage, count, p50, p99 in results['stages']:
+        print("%-28s %8d %10.3f %10.3f" % (stage, count, p50, p99))
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--device-types', type=int, default=2)
+    parser.add_argument('--devices-per-type', type=int, default=50)
+    parser.add_argument('--messages', type=int, default=100,
+                        help='messages stored for each device at the start')
+    parser.add_argument('--new-messages', type=int, default=5,
+                        help='messages sent by each device between iterations')
+    parser.add_argument('--page-size', type=int, default=100)
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='seconds added to each request by the stub')
+    parser.add_argument('--iterations', type=int, default=3)
+    parser.add_argument('--workers', type=int, default=8,
+                        help='request threads, 0 to scrape sequentially')
+    parser.add_argument('--no-incremental', dest='incremental', action='store_false')
+    parser.add_argument('--no-pipelined', dest='pipelined', action='store_false')
+    parser.add_argument('--rate', type=float, default=0,
+                        help='requests per second allowed, 0 for no limit')
+    parser.add_argument('--catalog-ttl', type=int, default=3600)
+    parser.add_argument('--db-latency', type=float, default=0.0,
+                        help='seconds added to each fake database round trip')
+    parser.add_argument('--postgres', action='store_true',
+                        help='write to a real database instead of the fake')
+    parser.add_argument('--db-name', default='scraper_benchmark')
+    parser.add_argument('--db-user', default='postgres')
+    parser.add_argument('--db-password', default='')
+    parser.add_argument('--host', default='localhost')
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    print_report(run(parse_args(argv)))
+
+if __name__ == '__main__':
+    main()
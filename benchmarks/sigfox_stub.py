@@ -0,0 +1,191 @@
+"""
+This module features the SigfoxStubServer() class. The class serves the parts
+of the Sigfox API used by the scraper from a local HTTP server, with generated
+devices and messages, so that the scraper can be benchmarked offline.
+"""
+
+import binascii
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+API_PATH = '/api/'
+START_TIME = 1500000000
+MESSAGE_INTERVAL = 600
+# Decoded payloads cycled through by the generated messages
+PAYLOADS = ('BAZ', 'NbC', 'NGL', 'BcK', 'NZZ')
+# Connections waiting to be accepted, well above the scraper's worker count
+REQUEST_QUEUE_SIZE = 128
+
+
+class SigfoxStubHTTPServer(ThreadingHTTPServer):
+    """
+    Threaded HTTP server with a listen backlog large enough for concurrent
+    scrapers, whose connections would otherwise overflow the default of 5
+    and wait for a SYN retransmit.
+    """
+
+    request_queue_size = REQUEST_QUEUE_SIZE
+
+
+class SigfoxStubHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        """
+        Answers a request for device types, devices of a type, or messages
+        of a device.
+        """
+        stub = self.server.stub
+        if stub.latency:
+            time.sleep(stub.latency)
+
+        url = urlparse(self.path)
+        params = parse_qs(url.query)
+        parts = url.path[len(API_PATH):].strip('/').split('/')
+
+        if parts == ['devicetypes']:
+            body = stub.device_types_response()
+        elif len(parts) == 3 and parts[0] == 'devicetypes' and parts[2] == 'devices':
+            body = stub.devices_response(parts[1])
+        elif len(parts) == 3 and parts[0] == 'devices' and parts[2] == 'messages':
+            body = stub.messages_response(parts[1], params)
+        else:
+            body = None
+
+        if body is None:
+            self.send_response(404)
+            self.end_headers()
+            return
+
+        content = json.dumps(body).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class SigfoxStubServer(object):
+
+    def __init__(self, device_types=2, devices_per_type=50, messages_per_device=100,
+                                                        page_size=100, latency=0.0):
+        """
+        Initializes the stub with generated devices and messages. The server
+        must be started with start().
+
+        device_types (int): [OPTIONAL] Number of device types
+        devices_per_type (int): [OPTIONAL] Number of devices of each type
+        messages_per_device (int): [OPTIONAL] Messages stored for each device
+        page_size (int): [OPTIONAL] Most messages returned in one page
+        latency (float): [OPTIONAL] Seconds each request is delayed by
+        """
+        self.page_size = page_size
+        self.latency = latency
+        self.requests = 0
+        self._lock = threading.Lock()
+
+        self._devices = {}
+        for type_index in range(device_types):
+            device_type_id = 'type%d' % type_index
+            self._devices[device_type_id] = ['%X' % (0x10000 + type_index * 
+                    devices_per_type + device_index) for device_index in range(devices_per_type)]
+
+        self._message_count = 0
+        self.advance(messages_per_device)
+
+        self._server = SigfoxStubHTTPServer(('127.0.0.1', 0), SigfoxStubHandler)
+        self._server.daemon_threads = True
+        self._server.stub = self
+        self._thread = None
+
+    @property
+    def api_url(self):
+        """
+        Base URL of the stub API, to be given to SigfoxScraper.
+        """
+        return 'http://127.0.0.1:%d%s' % (self._server.server_port, API_PATH)
+
+    def device_ids(self):
+        """
+        Returns a list of the ID of every device served.
+        """
+        return [device for devices in self._devices.values() for device in devices]
+
+    def advance(self, count):
+        """
+        Makes every device send count more messages.
+
+        count (int): Number of new messages for each device
+        """
+        with self._lock:
+            self._message_count += count
+
+    def start(self):
+        """
+        Starts serving requests from a background thread.
+        """
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stops the server.
+        """
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _count_request(self):
+        with self._lock:
+            self.requests += 1
+
+    def device_types_response(self):
+        self._count_request()
+        return {'data': [{'id': device_type_id} for device_type_id in self._devices]}
+
+    def devices_response(self, device_type_id):
+        self._count_request()
+        if device_type_id not in self._devices:
+            return None
+        return {'data': [{'id': device} for device in self._devices[device_type_id]]}
+
+    def messages_response(self, device, params):
+        """
+        Returns a page of messages, newest first, honouring the since,
+        before and limit parameters like the Sigfox API.
+        """
+        self._count_request()
+        limit = int(params.get('limit', [self.page_size])[0])
+        since = int(params['since'][0]) if 'since' in params else None
+        before = int(params['before'][0]) if 'before' in params else None
+
+        with self._lock:
+            message_count = self._message_count
+
+        data = []
+        index = message_count - 1
+        while index >= 0 and len(data) < limit:
+            time_sent = START_TIME + index * MESSAGE_INTERVAL
+            index -= 1
+            if before is not None and time_sent >= before:
+                continue
+            if since is not None and time_sent <= since:
+                break
+
+            payload = PAYLOADS[(index + 1) % len(PAYLOADS)]
+            data.append({'device': device, 'time': time_sent,
+                            'data': binascii.hexlify(payload.encode()).decode()})
+
+        paging = {}
+        if len(data) == limit and index >= 0:
+            next_url = '%sdevices/%s/messages/?limit=%d&before=%d' % (self.api_url,
+                                                    device, limit, data[-1]['time'])
+            if since is not None:
+                next_url += '&since=%d' % since
+            paging['next'] = next_url
+
+        return {'data': data, 'paging': paging}
@@ -1,95 +1,739 @@
 from scraper.sigfox_scraper import SigfoxScraper
-from scraper.postgres_interface import PostgresInterface
+from scraper.postgres_interface import PostgresInterface, close_pools
 from scraper.postgres_interaction import PostgresInteraction
 from scraper.sigfox_parser import SigfoxParser
 from scraper.message_parser import MessageParser
-from login_details import FIRST_USER, FIRST_PASSWORD, SECOND_USER, SECOND_PASSWORD
-from login_details import DB_NAME, DB_USER, DB_PASSWORD, HOST
+from scraper.device_catalog import DeviceCatalog
+from scraper.latest_state import LatestState
+from scraper.database_writer import DatabaseWriter
+from scraper.device_progress import DeviceProgress
+from scraper.metrics import METRICS, MetricsServer
+from scraper.log_config import configure_logging
+from scraper.supervisor import Supervisor, PartitionClaims
+from scraper.poll_scheduler import PollScheduler
+from scraper.rate_limiter import get_rate_limiter
+from scraper.message_batch import MessageBatch
+from scraper.profiling import IterationProfiler, profile_every_from_environment
+from scraper.profiling import profile_section
+from scraper.profiling import PROFILE_ENVIRONMENT_VARIABLE
 
+import argparse
+import csv
 import logging
+import os
+import time
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 DATA_KEY = 'data'
 ID_KEY = 'id'
 NODE_ID_INDEX = 0
 LOGGING_FILE = 'scraper.log'
+WORKER_LOGGING_FILE = 'scraper.worker%d.log'
+LOGGING_LEVEL = logging.DEBUG
+# Repeated debug messages, such as the one per message, kept each minute
+DEBUG_LOG_RATE_LIMIT = 100
+INCREMENTAL_SCRAPING = True
+DB_MIN_CONNECTIONS = 1
+DB_MAX_CONNECTIONS = 10
+SCRAPER_WORKERS = 8
+# Requests per second and requests in flight allowed for each Sigfox account
+SIGFOX_REQUEST_RATE = 10
+SIGFOX_REQUEST_BURST = 20
+SIGFOX_MAX_CONCURRENCY = SCRAPER_WORKERS
+CATALOG_TTL = 3600
+PIPELINED_WRITES = True
+METRICS_PORT = 9108
+METRICS_LOG_INTERVAL = 60
+# Most device polls started each POLL_BUDGET_INTERVAL seconds, across accounts
+POLL_BUDGET = 600
+POLL_BUDGET_INTERVAL = 60
+# Longest sleep between two checks for due devices
+MAX_IDLE_SLEEP = 30
+MAINTENANCE_BATCH_SIZE = 10000
+PROFILE_DIRECTORY = 'profiles'
 
-def scrape_messages(user, password):
+def load_latest_message_times(db):
     """
-    With given API user and password access keys, this function will 
-    continuously scrape for messages from each device group that is given.
+    Loads the time of the newest stored message for every device from the
+    database. This is used as the starting point for incremental scraping.
+
+    db (scraper.PostgresInteraction): Connection to the database
+    """
+    return db.retrieve_latest_message_times()
+
+def retrieve_devices(scraper, sigfox_parser, executor=None, catalog=None,
+                                                            device_filter=None):
+    """
+    Returns a list of the Sigfox IDs of every device registered to the
+    account of the given scraper. If an executor is given, the devices of
+    each device type are requested in parallel.
+
+    scraper (scraper.SigfoxScraper): Scraper for the account
+    sigfox_parser (scraper.SigfoxParser): Parser for the API responses
+    executor (concurrent.futures.Executor): [OPTIONAL] Runs the requests
+    catalog (scraper.DeviceCatalog): [OPTIONAL] Cache of the devices of the
+    account. If given, the devices are only requested when it has expired
+    device_filter (function): [OPTIONAL] Only devices for which it returns
+    True are returned
+    """
+    if catalog is not None:
+        devices = catalog.devices(executor)
+    else:
+        devices = request_devices(scraper, sigfox_parser, executor)
+
+    if device_filter is not None:
+        devices = [device for device in devices if device_filter(device)]
+
+    return devices
 
-    user (str): API user key
-    password (str): API password key
+def request_devices(scraper, sigfox_parser, executor=None):
+    """
+    Requests the device types of the account of the given scraper and the
+    devices of each type, returning a list of their Sigfox IDs.
+
+    scraper (scraper.SigfoxScraper): Scraper for the account
+    sigfox_parser (scraper.SigfoxParser): Parser for the API responses
+    executor (concurrent.futures.Executor): [OPTIONAL] Runs the requests
     """
-    scraper = SigfoxScraper(user, password)
     device_types = scraper.request_device_types()
 
     # Parse the data to allow conversion and readability
-    sigfox_parser = SigfoxParser()
     device_type_ids = sigfox_parser.retrieve_device_type_ids_from_response(device_types)
 
     # Retrieve device information to pull messages
-    devices = {}
-    for device_type_id in device_type_ids:
-        devices_of_type = scraper.request_devices(device_type_id)
-        devices[device_type_id] = sigfox_parser. \
-            retrieve_device_id_from_response(devices_of_type)
-    
-    # Set up database interaction to allow it to be used
-    db = PostgresInteraction(DB_NAME, DB_USER, DB_PASSWORD, HOST)    
+    if executor is None:
+        responses = [scraper.request_devices(device_type_id)
+                                    for device_type_id in device_type_ids]
+    else:
+        responses = executor.map(scraper.request_devices, device_type_ids)
+
+    devices = []
+    for devices_of_type in responses:
+        devices.extend(sigfox_parser.retrieve_device_id_from_response(devices_of_type))
+
+    return devices
+
+def resolve_node_id(db, device):
+    """
+    Makes sure the device is stored as a node and returns its node ID. Known
+    nodes are resolved from memory, without a database round trip.
+
+    db (scraper.PostgresInteraction): Connection to the database
+    device (str): Sigfox ID of the device
+    """
+    node_id = db.nodes.resolve(device, False)
+    if node_id is None:
+        logging.error("Node could not be inserted: %s", device)
+
+    return node_id
+
+def fetch_device_messages(scraper, sigfox_parser, device, since=None):
+    """
+    Requests every page of messages of a device, returning them as one
+    scraper.MessageBatch, newest first.
+
+    scraper (scraper.SigfoxScraper): Scraper for the account of the device
+    sigfox_parser (scraper.SigfoxParser): Parser for the API responses
+    device (str): Sigfox ID of the device
+    since (int): [OPTIONAL] Only request messages sent after this time
+    """
+    # Runs in the executor threads, which the iteration profile does not see
+    with profile_section(), METRICS.timer('device_fetch', account=scraper.account):
+        batch = None
+        for page in scraper.iter_device_message_pages(device, since):
+            batch = sigfox_parser.retrieve_message_batch_from_response(page, since,
+                                                                    batch=batch)
+        return batch
+
+def store_device_messages(db, message_parser, node_id, batch, latest_message=True,
+                                latest_state=None, writer=None, on_messages=None,
+                                                                on_stored=None):
+    """
+    Writes a batch of messages of a device to the database. Unless
+    latest_message is False, the newest message is also stored as the latest
+    message of the node. Returns the time up to which every message of the
+    batch is stored: the time of the newest message, or just before the
+    oldest message which could not be inserted. Returns None if there were
+    no new messages, or if the messages were queued to the writer, which
+    reports the time through on_stored once they are written.
+
+    db (scraper.PostgresInteraction): Connection to the database
+    message_parser (scraper.MessageParser): Decoder for message contents
+    node_id (int): ID of the node as given by the database
+    batch (scraper.MessageBatch): New messages of the device, as returned by
+    fetch_device_messages()
+    latest_message (bool): [OPTIONAL] False if newer messages of the node
+    have already been stored
+    latest_state (scraper.LatestState): [OPTIONAL] If given, the latest
+    message is recorded there and written when it is flushed
+    writer (scraper.DatabaseWriter): [OPTIONAL] If given, the messages are
+    queued to be written by the writer thread instead
+    on_messages (function): [OPTIONAL] Called with the batch of new messages
+    on_stored (function): [OPTIONAL] Called with the time returned, once the
+    messages are written
+    """
+    if batch is None or not len(batch):
+        return None
+
+    batch.assign_node_id(node_id)
+    newest = batch.newest()
+    newest_time = batch.times[newest]
+    logging.debug("Messages: %d, newest time: %s", len(batch), newest_time)
+
+    latest = None
+    if latest_message == True:
+        latest = (node_id, batch.messages[newest], newest_time)
+
+    if on_messages is not None:
+        on_messages(batch)
+
+    if writer is not None:
+        writer.put(batch, latest, on_stored)
+        return None
+    else:
+        failed_rows = db.add_message_batch(batch)
+        for failed_row in failed_rows:
+            logging.error("Message could not be inserted: %s", failed_row)
+
+        if failed_rows:
+            # The failed messages must still be newer than the time used
+            # to request the device again, so they are retried
+            newest_time = min(failed_row[2] for failed_row in failed_rows) - 1
+
+        if latest is not None and latest_state is not None:
+            latest_state.update(*latest)
+        elif latest is not None:
+            node_id, message, seconds_since_unix_epoch = latest
+            message_parser.insert_message_to_latest_message(message, db, 
+                                        node_id, seconds_since_unix_epoch)
+            is_there = message_parser.retrieve_button_pressed(message[0])
+            db.update_buoy_checked_by_node_id(seconds_since_unix_epoch, node_id, is_there)
+
+    if on_stored is not None:
+        on_stored(newest_time)
+    return newest_time
+
+def scrape_device(scraper, db, sigfox_parser, message_parser, device, 
+                            latest_times=None, latest_state=None, writer=None,
+                                                            on_messages=None):
+    """
+    Requests the messages of a device page by page, writing each page to
+    the database before the next one is requested.
+
+    scraper (scraper.SigfoxScraper): Scraper for the account of the device
+    db (scraper.PostgresInteraction): Connection to the database
+    sigfox_parser (scraper.SigfoxParser): Parser for the API responses
+    message_parser (scraper.MessageParser): Decoder for message contents
+    device (str): Sigfox ID of the device
+    latest_times (dict): [OPTIONAL] Newest stored time per device, moved
+    forward once every page is written
+    latest_state (scraper.LatestState): [OPTIONAL] Collects latest messages
+    writer (scraper.DatabaseWriter): [OPTIONAL] Writes the messages
+    on_messages (function): [OPTIONAL] Called with the device and each
+    batch of its new messages
+    """
+    since = None
+    progress = None
+    if latest_times is not None:
+        since = latest_times.get(device)
+        progress = DeviceProgress(latest_times, device)
+
+    node_id = resolve_node_id(db, device)
+    if node_id is None:
+        return
+
+    device_messages = None
+    if on_messages is not None:
+        device_messages = partial(on_messages, device)
+
+    # Pages are newest first, so only the first one has the latest message
+    latest_message = True
+    for page in scraper.iter_device_message_pages(device, since):
+        batch = sigfox_parser.retrieve_message_batch_from_response(page, since, node_id)
+        if not len(batch):
+            continue
+
+        on_stored = None
+        if progress is not None:
+            on_stored = progress.expect(batch.times[batch.newest()])
+
+        store_device_messages(db, message_parser, node_id, batch, latest_message,
+                            latest_state, writer, device_messages, on_stored)
+        latest_message = False
+
+    if progress is not None:
+        progress.finish()
+
+def scrape_messages(scraper, db, latest_times=None, workers=None, catalog=None,
+                                latest_state=None, writer=None, device_filter=None,
+                                                                on_messages=None):
+    """
+    With the given scraper for an API account, this function will 
+    continuously scrape for messages from each device group that is given.
+
+    scraper (scraper.SigfoxScraper): Scraper holding the API user and
+    password keys. It is kept between iterations to reuse its connections
+    db (scraper.PostgresInteraction): Connection to the database, shared
+    between accounts and iterations
+    latest_times (dict): [OPTIONAL] Sigfox ID to the time of the newest
+    message already stored for that device. If given, only newer messages
+    are requested and the dict is updated as messages are stored.
+    workers (int): [OPTIONAL] If given, requests to Sigfox are made in
+    parallel by this many threads. Messages are stored as each device's
+    request completes, and a failing device does not stop the others.
+    catalog (scraper.DeviceCatalog): [OPTIONAL] Cache of the devices of the
+    account, reused between iterations
+    latest_state (scraper.LatestState): [OPTIONAL] Collects the latest
+    message of each node, to be written when it is flushed
+    writer (scraper.DatabaseWriter): [OPTIONAL] If given, messages are
+    written by the writer thread while the next requests are made
+    device_filter (function): [OPTIONAL] Only devices for which it returns
+    True are scraped
+    on_messages (function): [OPTIONAL] Called with each device and each
+    scraper.MessageBatch of its new messages
+    """
+    sigfox_parser = SigfoxParser()
     message_parser = MessageParser()
-    
-    for value in devices.values():
-        # value can be a list of devices
-        for device in value:
-            if db.add_node(device, False):
-                logging.debug("Node inserted: %s" % device)
-            else:
-                logging.error("Node could not be inserted: %s" % device)
-
-            payload = None
-                
-            device_messages = scraper.request_device_messages(device, payload)
-            encoded_messages = sigfox_parser.retrieve_device_messages_from_response(device_messages)
-
-            rows = db.retrieve_node_by_sigfox_id(device)
-            for row in rows:
-                node_id = row[NODE_ID_INDEX]
-
-            MESSAGE_INDEX = 0
-            TIME_INDEX = 1
-
-            latest_message = True
-            for encoded_message in encoded_messages:
-                message = sigfox_parser.convert_message_from_hex(encoded_message[MESSAGE_INDEX])
-                seconds_since_unix_epoch = encoded_message[TIME_INDEX]
-                logging.debug("Time: %s" % (seconds_since_unix_epoch))
-                db.add_message(node_id, message, seconds_since_unix_epoch)
-
-                if latest_message == True:
-                    message_parser.insert_message_to_latest_message(message, db, 
-                                                node_id, seconds_since_unix_epoch)
-                    is_there = message_parser.retrieve_button_pressed(message[0])
-                    db.update_buoy_checked_by_node_id(seconds_since_unix_epoch, node_id, is_there)
-                    latest_message = False
-
-def main():
+
+    if workers:
+        scrape_messages_concurrently(scraper, sigfox_parser, message_parser,
+                db, latest_times, workers, catalog, latest_state, writer, device_filter,
+                                                                    on_messages)
+        return
+
+    for device in retrieve_devices(scraper, sigfox_parser, catalog=catalog,
+                                                    device_filter=device_filter):
+        with METRICS.timer('device_cycle', account=scraper.account):
+            scrape_device(scraper, db, sigfox_parser, message_parser, device,
+                                latest_times, latest_state, writer, on_messages)
+
+def scrape_messages_concurrently(scraper, sigfox_parser, message_parser, db,
+            latest_times, workers, catalog=None, latest_state=None, writer=None,
+                                            device_filter=None, on_messages=None):
+    """
+    Requests device lists and device messages with a bounded pool of
+    threads. Responses are written to the database from the calling thread
+    as they complete. Errors are logged per device.
+
+    scraper (scraper.SigfoxScraper): Scraper for the account
+    sigfox_parser (scraper.SigfoxParser): Parser for the API responses
+    message_parser (scraper.MessageParser): Decoder for message contents
+    db (scraper.PostgresInteraction): Connection to the database
+    latest_times (dict): Newest stored time per device, or None. A device
+    is moved forward once its messages are written
+    workers (int): Number of threads making requests
+    catalog (scraper.DeviceCatalog): [OPTIONAL] Cache of the devices
+    latest_state (scraper.LatestState): [OPTIONAL] Collects latest messages
+    writer (scraper.DatabaseWriter): [OPTIONAL] Writes the messages
+    device_filter (function): [OPTIONAL] Selects the devices to scrape
+    on_messages (function): [OPTIONAL] Called with each device and the
+    batch of its new messages
+    """
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        devices = retrieve_devices(scraper, sigfox_parser, executor, catalog,
+                                                                device_filter)
+
+        futures = {}
+        for device in devices:
+            since = None
+            if latest_times is not None:
+                since = latest_times.get(device)
+
+            future = executor.submit(fetch_device_messages, scraper, sigfox_parser,
+                                                                    device, since)
+            futures[future] = device
+
+        for future in as_completed(futures):
+            device = futures[future]
+            try:
+                batch = future.result()
+                with METRICS.timer('device_store', account=scraper.account):
+                    node_id = resolve_node_id(db, device)
+                    if node_id is None:
+                        continue
+
+                    device_messages = None
+                    if on_messages is not None:
+                        device_messages = partial(on_messages, device)
+
+                    on_stored = None
+                    if latest_times is not None and batch is not None and len(batch):
+                        progress = DeviceProgress(latest_times, device)
+                        on_stored = progress.expect(batch.times[batch.newest()])
+                        progress.finish()
+
+                    store_device_messages(db, message_parser, node_id, batch,
+                                latest_state=latest_state, writer=writer,
+                                on_messages=device_messages, on_stored=on_stored)
+            except Exception:
+                METRICS.increment('device_errors', account=scraper.account)
+                logging.exception("Device could not be scraped: %s", device)
+
+def poll_due_devices(scrapers, catalogs, db, latest_times, latest_state, writer,
+                                                            scheduler, due, i):
+    """
+    Body of an iteration of run_scraper(): scrapes the devices which are
+    due, reschedules them and writes their latest messages and rollups.
+
+    scrapers (list): scraper.SigfoxScraper of every account
+    catalogs (dict): Scraper to its scraper.DeviceCatalog
+    db (scraper.PostgresInteraction): Connection to the database
+    latest_times (dict): Newest stored time per device, or None
+    latest_state (scraper.LatestState): Collects the latest messages
+    writer (scraper.DatabaseWriter): Writes the messages, or None
+    scheduler (scraper.PollScheduler): Schedule of the devices
+    due (dict): Account to the set of its devices which are due
+    i (int): Index of the iteration, for the log
+    """
+    logging.debug("Iteration %d: Begin, %d devices due", i, 
+                            sum(len(devices) for devices in due.values()))
+
+    for scraper in scrapers:
+        devices = due.get(scraper.account)
+        if not devices:
+            continue
+
+        METRICS.increment('devices_polled', len(devices), account=scraper.account)
+        try:
+            with METRICS.timer('account_cycle', account=scraper.account):
+                scrape_messages(scraper, db, latest_times, SCRAPER_WORKERS,
+                        catalogs[scraper], latest_state, writer,
+                        devices.__contains__,
+                        partial(scheduler.record_messages, scraper.account))
+        except Exception:
+            METRICS.increment('account_errors', account=scraper.account)
+            logging.exception("Account could not be scraped: %s", scraper.account)
+        finally:
+            for device in devices:
+                scheduler.reschedule(scraper.account, device)
+
+    if writer is not None:
+        writer.flush()
+        logging.debug("Iteration %d: Writer %s", i, writer.stats())
+
+    # Write the latest message of every node which changed at once
+    flush_pending(db, latest_state)
+
+def flush_pending(db, latest_state):
+    """
+    Writes the latest messages and the rollups collected since the last
+    flush. Errors are logged and counted, so that a database outage does not
+    stop the scraper; whatever could not be written is kept for next time.
+
+    db (scraper.PostgresInteraction): Connection to the database
+    latest_state (scraper.LatestState): Collects the latest messages
+    """
+    for flush in (latest_state.flush, db.rollups.flush):
+        try:
+            flush()
+        except Exception:
+            METRICS.increment('flush_errors')
+            logging.exception("Pending writes could not be flushed")
+
+def run_scraper(login_details, db_settings, claims=None, metrics_port=METRICS_PORT,
+                                                                profile_every=0):
+    """
+    Scrapes the messages of every account until interrupted. Each device is
+    polled when the PollScheduler expects it to have sent a new message,
+    within a global budget of polls.
+
+    login_details (dict): API user keys to API password keys
+    db_settings (tuple): Database name, user, password and host
+    claims (scraper.PartitionClaims): [OPTIONAL] If given, only devices in
+    the partitions claimed by this process are scraped
+    metrics_port (int): [OPTIONAL] Port the metrics are served on
+    profile_every (int): [OPTIONAL] If given, every Nth iteration is
+    profiled, see scraper.IterationProfiler
+    """
+    scrapers = []
+    catalogs = {}
+    for user, password in login_details.items():
+        rate_limiter = get_rate_limiter(user, rate=SIGFOX_REQUEST_RATE,
+                                burst=SIGFOX_REQUEST_BURST,
+                                max_concurrency=SIGFOX_MAX_CONCURRENCY)
+        scraper = SigfoxScraper(user, password, pool_size=SCRAPER_WORKERS,
+                                                    rate_limiter=rate_limiter)
+        scrapers.append(scraper)
+        catalogs[scraper] = DeviceCatalog(scraper, CATALOG_TTL)
+
+    # Set up database interaction to allow it to be used
+    db = PostgresInteraction(*db_settings, pooled=True,
+                                min_connections=DB_MIN_CONNECTIONS,
+                                max_connections=DB_MAX_CONNECTIONS)
+
+    latest_times = None
+    if INCREMENTAL_SCRAPING:
+        latest_times = load_latest_message_times(db)
+
+    latest_state = LatestState(db)
+    db.create_rollup_tables()
+
+    writer = None
+    if PIPELINED_WRITES:
+        writer = DatabaseWriter(db, latest_state)
+        writer.start()
+
+    # Serve the counters and timers for Prometheus on the local machine
+    metrics_server = MetricsServer(metrics_port)
+    metrics_server.start()
+    metrics_logged_at = time.monotonic()
+
+    sigfox_parser = SigfoxParser()
+    scheduler = PollScheduler(budget=POLL_BUDGET, budget_interval=POLL_BUDGET_INTERVAL)
+    profiler = IterationProfiler(profile_every, PROFILE_DIRECTORY)
+
+    # Start scraping for Sigfox data
+    try:
+        i = 0
+        while True:
+            if claims is not None:
+                try:
+                    claims.claim()
+                except Exception:
+                    logging.exception("Partitions could not be claimed")
+
+            # An account whose devices cannot be listed keeps its schedule,
+            # and the other accounts are still scraped
+            for scraper in scrapers:
+                device_filter = None
+                if claims is not None:
+                    device_filter = claims.device_filter(scraper.account)
+
+                try:
+                    devices = retrieve_devices(scraper, sigfox_parser,
+                                catalog=catalogs[scraper], device_filter=device_filter)
+                except Exception:
+                    METRICS.increment('account_errors', account=scraper.account)
+                    logging.exception("Devices could not be listed: %s", scraper.account)
+                    continue
+
+                scheduler.sync(scraper.account, devices)
+
+            due = scheduler.due()
+            if due:
+                with profiler.iteration(i):
+                    poll_due_devices(scrapers, catalogs, db, latest_times, latest_state,
+                                                                writer, scheduler, due, i)
+                i += 1
+
+            if time.monotonic() - metrics_logged_at >= METRICS_LOG_INTERVAL:
+                logging.info("Iteration %d: Metrics %s", i, METRICS.summary())
+                metrics_logged_at = time.monotonic()
+
+            wait = scheduler.seconds_until_due()
+            if wait is None or wait > MAX_IDLE_SLEEP:
+                wait = MAX_IDLE_SLEEP
+            time.sleep(wait)
+    finally:
+        metrics_server.stop()
+        if writer is not None:
+            writer.close()
+
+        # The messages written last are stored, so their latest messages
+        # and rollups must be too, or they would never be added
+        flush_pending(db, latest_state)
+        for scraper in scrapers:
+            scraper.close()
+        close_pools()
+
+def remove_duplicate_messages(db_settings, batch_size):
+    """
+    One-off maintenance which deletes duplicate messages node by node, in
+    batches so that no statement holds its locks for long, and then creates
+    the unique index which keeps new duplicates out.
+
+    db_settings (tuple): Database name, user, password and host
+    batch_size (int): Most messages deleted by one statement
+    """
+    db = PostgresInteraction(*db_settings)
+    try:
+        removed = 0
+        for node_id, sigfox_id, active in db.retrieve_all_nodes():
+            while True:
+                deleted = db.remove_duplicate_messages(node_id, batch_size)
+                if deleted is None:
+                    raise RuntimeError("Duplicates of node %s could not be removed" % sigfox_id)
+
+                removed += deleted
+                if deleted < batch_size:
+                    break
+
+            logging.info("Duplicate messages removed up to node %s: %d", sigfox_id, removed)
+
+        if not db.create_message_unique_index():
+            raise RuntimeError("Unique index of the message table could not be created")
+        logging.info("Duplicate messages removed: %d", removed)
+    finally:
+        db.close()
+
+def rebuild_rollups(db_settings, batch_size):
+    """
+    Catch-up command which rebuilds the hourly and daily sensor rollups of
+    every node from the message history, reading batch_size messages at a
+    time. Messages entered after a node is started on are left to the
+    scraper, so it is best run while the scraper is stopped or has just
+    been started with the rollups.
+
+    db_settings (tuple): Database name, user, password and host
+    batch_size (int): Most messages read and rolled up at once
+    """
+    db = PostgresInteraction(*db_settings)
+    try:
+        if not db.create_rollup_tables():
+            raise RuntimeError("Rollup tables could not be created")
+
+        for node_id, sigfox_id, active in db.retrieve_all_nodes():
+            if not db.delete_rollups(node_id):
+                raise RuntimeError("Rollups of node %s could not be deleted" % sigfox_id)
+            entered_before = int(time.time())
+
+            after = -1
+            rolled_up = 0
+            while True:
+                rows = db.retrieve_message_history(node_id, after, entered_before,
+                                                                        batch_size)
+                if not rows:
+                    break
+
+                batch = MessageBatch.from_rows([(node_id, message, time_sent)
+                                                    for message, time_sent in rows])
+                db.rollups.add(batch)
+                db.rollups.flush()
+                if db.rollups.pending():
+                    raise RuntimeError("Rollups of node %s could not be written" % sigfox_id)
+
+                rolled_up += len(rows)
+                after = rows[-1][1]
+                if len(rows) < batch_size:
+                    break
+
+            logging.info("Rollups rebuilt for node %s: %d messages", sigfox_id, rolled_up)
+    finally:
+        db.close()
+
+def export_messages(db_settings, path, since=None):
+    """
+    Writes the message history to a CSV file of sigfox_id, time_sent in
+    seconds since unix epoch and message_text, oldest first. The messages
+    are streamed from the database, so the history is never held in memory.
+
+    db_settings (tuple): Database name, user, password and host
+    path (str): File to write
+    since (int): [OPTIONAL] Only export messages sent after this time
+    """
+    db = PostgresInteraction(*db_settings)
+    try:
+        exported = 0
+        with open(path, 'w', newline='') as export_file:
+            export_writer = csv.writer(export_file)
+            export_writer.writerow(('sigfox_id', 'time_sent', 'message_text'))
+            for row in db.iter_message_history(since):
+                export_writer.writerow(row)
+                exported += 1
+
+        logging.info("Messages exported to %s: %d", path, exported)
+    finally:
+        db.close()
+
+def run_worker(worker_index, preferred, units, partition_count, login_details,
+                                                                    db_settings):
+    """
+    Entry point of a worker process started by the supervisor. The worker
+    scrapes the devices in the partitions it holds advisory locks for.
+
+    worker_index (int): Index of the worker
+    preferred (list): (account, partition) units to claim first
+    units (list): Every (account, partition) unit
+    partition_count (int): Number of partitions of each account
+    login_details (dict): API user keys to API password keys
+    db_settings (tuple): Database name, user, password and host
+    """
+    log_listener = configure_logging(WORKER_LOGGING_FILE % worker_index, LOGGING_LEVEL,
+                                        rate_limit=DEBUG_LOG_RATE_LIMIT)
+    try:
+        # The locks belong to this connection, so it is not pooled and is
+        # kept open for as long as the worker runs
+        lock_db = PostgresInteraction(*db_settings)
+        claims = PartitionClaims(lock_db, units, preferred, partition_count)
+        run_scraper(login_details, db_settings, claims,
+                                    metrics_port=METRICS_PORT + 1 + worker_index,
+                                    profile_every=profile_every_from_environment())
+    except:
+        logging.exception("Worker %d stopped", worker_index)
+        raise
+    finally:
+        log_listener.stop()
+
+def parse_args(argv=None):
+    """
+    Parses the command line arguments of the scraper.
+
+    argv (list): [OPTIONAL] Arguments, taken from sys.argv if not given
+    """
+    parser = argparse.ArgumentParser(description="Scrapes Sigfox messages into Postgres.")
+    parser.add_argument('--processes', type=int, default=0,
+                        help='run this many worker processes under a supervisor')
+    parser.add_argument('--partitions', type=int, default=None,
+                        help='partitions of the devices of each account, '
+                             'defaults to the number of processes')
+    parser.add_argument('--remove-duplicates', action='store_true',
+                        help='delete duplicate messages, create the unique '
+                             'index of the message table and exit')
+    parser.add_argument('--rebuild-rollups', action='store_true',
+                        help='rebuild the sensor rollups from the message history and exit')
+    parser.add_argument('--export-messages', metavar='PATH', default=None,
+                        help='write the message history to a CSV file and exit')
+    parser.add_argument('--since', type=int, default=None,
+                        help='only export messages sent after this unix time')
+    parser.add_argument('--profile-every', type=int, metavar='N',
+                        default=profile_every_from_environment(),
+                        help='profile every Nth iteration with cProfile and '
+                             'tracemalloc, also set by %s' % PROFILE_ENVIRONMENT_VARIABLE)
+    parser.add_argument('--batch-size', type=int, default=MAINTENANCE_BATCH_SIZE,
+                        help='messages handled at once by --remove-duplicates '
+                             'and --rebuild-rollups')
+    return parser.parse_args(argv)
+
+def main(argv=None):
     """
     Entry point for the scraper. 
     """
+    # Imported here so that the functions above can be used without the
+    # login details, as the benchmarks do
+    from login_details import FIRST_USER, FIRST_PASSWORD, SECOND_USER, SECOND_PASSWORD
+    from login_details import DB_NAME, DB_USER, DB_PASSWORD, HOST
+
+    args = parse_args(argv)
     
-    # Config the logging output file
-    logging.basicConfig(filename=LOGGING_FILE, level=logging.DEBUG)
+    # Config the logging output file, written from a background thread
+    log_listener = configure_logging(LOGGING_FILE, LOGGING_LEVEL,
+                                        rate_limit=DEBUG_LOG_RATE_LIMIT)
 
     login_details = {FIRST_USER: FIRST_PASSWORD,
     SECOND_USER: SECOND_PASSWORD}
+    db_settings = (DB_NAME, DB_USER, DB_PASSWORD, HOST)
 
-    # Start scraping for Sigfox data
-    for i in range(10000):
-        logging.debug("Iteration %d: Begin" % (i,))
-
-        for user, password in login_details.items():
-            scrape_messages(user, password)
+    try:
+        if args.remove_duplicates:
+            remove_duplicate_messages(db_settings, args.batch_size)
+        elif args.rebuild_rollups:
+            rebuild_rollups(db_settings, args.batch_size)
+        elif args.export_messages:
+            export_messages(db_settings, args.export_messages, args.since)
+        elif args.processes:
+            # Passed to the workers, which inherit the environment
+            os.environ[PROFILE_ENVIRONMENT_VARIABLE] = str(args.profile_every)
+            partition_count = args.partitions or args.processes
+            units = [(user, partition) for user in login_details
+                                        for partition in range(partition_count)]
+            supervisor = Supervisor(run_worker, args.processes, units,
+                        (units, partition_count, login_details, db_settings))
+            supervisor.run()
+        else:
+            run_scraper(login_details, db_settings, profile_every=args.profile_every)
+    finally:
+        log_listener.stop()
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
@@ -0,0 +1,147 @@
+"""
+Replays Sigfox API responses recorded to disk into the database, to rebuild
+the message history after an outage or a migration without using the API.
+
+    python replay_scraper.py responses.jsonl.gz [more files...]
+
+Each file is read from the offset saved in its .offset checkpoint, which is
+updated after every chunk of messages is stored, so an interrupted replay
+continues where it stopped.
+"""
+
+from scraper.postgres_interaction import PostgresInteraction
+from scraper.postgres_interface import close_pools
+from scraper.sigfox_parser import SigfoxParser
+from scraper.message_batch import MessageBatch
+from scraper.latest_state import LatestState
+from scraper.metrics import METRICS
+from scraper.log_config import configure_logging
+from scraper.recorded_responses import iter_recorded_responses, split_by_device
+from scraper.recorded_responses import read_checkpoint, write_checkpoint
+from main_scraper import resolve_node_id, DEBUG_LOG_RATE_LIMIT
+
+import argparse
+import logging
+import time
+
+LOGGING_FILE = 'replay.log'
+LOGGING_LEVEL = logging.INFO
+# Messages written to the database by each bulk write
+CHUNK_SIZE = 5000
+
+def store_chunk(db, latest_state, batches, path, offset):
+    """
+    Writes the pending batches with one bulk write, flushes the latest
+    messages and rollups, and then saves the offset the file can be resumed from.
+    Returns the number of messages stored.
+
+    db (scraper.PostgresInteraction): Connection to the database
+    latest_state (scraper.LatestState): Collects the latest messages
+    batches (list): scraper.MessageBatch instances to write
+    path (str): Path of the recorded file
+    offset (int): Offset after the last record of the batches
+    """
+    batch = MessageBatch.concat(batches)
+    failed_rows = db.add_message_batch(batch)
+    for failed_row in failed_rows:
+        logging.error("Message could not be inserted: %s", failed_row)
+
+    latest_state.flush()
+    db.rollups.flush()
+    write_checkpoint(path, offset)
+    return len(batch) - len(failed_rows)
+
+def replay_file(db, path, chunk_size=CHUNK_SIZE, resume=True):
+    """
+    Replays the recorded responses of one file into the database. Returns
+    the number of messages stored.
+
+    db (scraper.PostgresInteraction): Connection to the database
+    path (str): Path of the recorded file, ending in .gz if compressed
+    chunk_size (int): [OPTIONAL] Messages written by each bulk write
+    resume (bool): [OPTIONAL] If False, the file is read from the start
+    even if it has a checkpoint
+    """
+    sigfox_parser = SigfoxParser()
+    latest_state = LatestState(db)
+    # node_id to the time of the newest message replayed, as the records
+    # are not necessarily in order
+    newest_times = {}
+
+    offset = read_checkpoint(path) if resume else 0
+    if offset:
+        logging.info("Resuming %s at offset %d", path, offset)
+
+    start = time.monotonic()
+    stored = 0
+    batches = []
+    pending = 0
+    for offset, record in iter_recorded_responses(path, offset):
+        METRICS.increment('replay_records')
+        for device, response in split_by_device(record):
+            node_id = resolve_node_id(db, device)
+            if node_id is None:
+                continue
+
+            batch = sigfox_parser.retrieve_message_batch_from_response(response,
+                                                                node_id=node_id)
+            if not len(batch):
+                continue
+
+            newest = batch.newest()
+            if batch.times[newest] > newest_times.get(node_id, -1):
+                newest_times[node_id] = batch.times[newest]
+                latest_state.update(node_id, batch.messages[newest], batch.times[newest])
+
+            batches.append(batch)
+            pending += len(batch)
+
+        if pending >= chunk_size:
+            stored += store_chunk(db, latest_state, batches, path, offset)
+            batches = []
+            pending = 0
+            logging.info("%s: %d messages stored, offset %d, %.0f messages/s", path,
+                                    stored, offset, stored / (time.monotonic() - start))
+
+    stored += store_chunk(db, latest_state, batches, path, offset)
+    logging.info("%s: replayed, %d messages stored", path, stored)
+    return stored
+
+def parse_args(argv=None):
+    """
+    Parses the command line arguments of the replay.
+
+    argv (list): [OPTIONAL] Arguments, taken from sys.argv if not given
+    """
+    parser = argparse.ArgumentParser(description="Replays recorded Sigfox responses into Postgres.")
+    parser.add_argument('files', nargs='+',
+                        help='JSON Lines files of recorded responses, optionally gzipped')
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE,
+                        help='messages written by each bulk write')
+    parser.add_argument('--no-resume', dest='resume', action='store_false',
+                        help='ignore saved offsets and replay every file from the start')
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    """
+    Entry point for the replay.
+    """
+    from login_details import DB_NAME, DB_USER, DB_PASSWORD, HOST
+
+    args = parse_args(argv)
+    log_listener = configure_logging(LOGGING_FILE, LOGGING_LEVEL,
+                                        rate_limit=DEBUG_LOG_RATE_LIMIT)
+
+    db = PostgresInteraction(DB_NAME, DB_USER, DB_PASSWORD, HOST)
+    try:
+        db.create_rollup_tables()
+        for path in args.files:
+            replay_file(db, path, args.chunk_size, args.resume)
+        logging.info("Metrics %s", METRICS.summary())
+    finally:
+        db.close()
+        close_pools()
+        log_listener.stop()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,221 @@
+"""
+This module features the DatabaseWriter() class. The class writes decoded
+messages to the database from its own thread, so that requests to Sigfox do
+not have to wait for the database.
+"""
+
+import logging
+import queue
+import threading
+import time
+
+from scraper.message_batch import MessageBatch
+from scraper.profiling import profile_section
+
+CLASS_NAME = "scraper.DatabaseWriter: "
+DEFAULT_MAX_QUEUE_SIZE = 1000
+DEFAULT_BATCH_SIZE = 100
+DEFAULT_BATCH_TIMEOUT = 0.5
+# Attempts to write a batch before its records are dropped, and the seconds
+# waited before the first retry, doubled for each retry after it
+WRITE_ATTEMPTS = 3
+RETRY_DELAY = 1.0
+
+# Put on the queue by close() to stop the thread once the queue is drained
+_STOP = object()
+# Put on the queue by flush() to write a partial batch without waiting
+_FLUSH = object()
+
+
+class DatabaseWriter(threading.Thread):
+
+    def __init__(self, db, latest_state, max_queue_size=DEFAULT_MAX_QUEUE_SIZE,
+                        batch_size=DEFAULT_BATCH_SIZE,
+                        batch_timeout=DEFAULT_BATCH_TIMEOUT):
+        """
+        Initializes the writer. The thread must be started with start().
+
+        db (scraper.PostgresInteraction): Connection to the database
+        latest_state (scraper.LatestState): Collects the latest message of
+        each node, to be written when it is flushed
+        max_queue_size (int): [OPTIONAL] Records which can wait to be written
+        before put() blocks
+        batch_size (int): [OPTIONAL] Most records written in one batch
+        batch_timeout (float): [OPTIONAL] Seconds to wait for more records
+        before a partial batch is written
+        """
+        super().__init__(name='DatabaseWriter', daemon=True)
+        self._db = db
+        self._latest_state = latest_state
+        self._queue = queue.Queue(max_queue_size)
+        self._batch_size = batch_size
+        self._batch_timeout = batch_timeout
+
+        self._lock = threading.Lock()
+        self._records_written = 0
+        self._messages_written = 0
+        self._messages_failed = 0
+        self._batches_written = 0
+        self._errors = 0
+        self._last_lag = 0.0
+        self._max_lag = 0.0
+
+    def put(self, batch, latest=None, on_stored=None):
+        """
+        Queues the messages of a device to be written. Blocks while the queue
+        is full, so that requests slow down when the database falls behind.
+
+        batch (scraper.MessageBatch): Messages of the device
+        latest (tuple): [OPTIONAL] (node_id, message, time_sent) of the
+        newest message of the node
+        on_stored (function): [OPTIONAL] Called from the writer thread once
+        the messages are written, with the time up to which every message
+        of the batch is stored: the time of the newest message, or just
+        before the oldest message which could not be inserted. It is not
+        called if the batch could not be written at all.
+        """
+        self._queue.put((time.monotonic(), batch, latest, on_stored))
+
+    def run(self):
+        """
+        Writes queued records in batches until close() is called.
+        """
+        stopping = False
+        while not stopping:
+            record = self._queue.get()
+            if record is _STOP:
+                self._queue.task_done()
+                break
+            if record is _FLUSH:
+                self._queue.task_done()
+                continue
+
+            batch = [record]
+            deadline = time.monotonic() + self._batch_timeout
+            while len(batch) < self._batch_size:
+                try:
+                    record = self._queue.get(timeout=max(0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+
+                if record is _STOP:
+                    self._queue.task_done()
+                    stopping = True
+                    break
+                if record is _FLUSH:
+                    self._queue.task_done()
+                    break
+                batch.append(record)
+
+            # Reported before the records are done, so that flush() returns
+            # with every stored time already reported
+            try:
+                for on_stored, stored_time in self._write_with_retries(batch):
+                    try:
+                        on_stored(stored_time)
+                    except:
+                        logging.exception('%s run() on_stored', CLASS_NAME)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def _write_with_retries(self, batch):
+        """
+        Writes a batch of records, trying again after a delay if writing
+        raises. Returns the reports to make as in _write(), or an empty list
+        if the records were dropped; their messages are then requested again
+        because their on_stored functions are never called.
+
+        batch (list): Records as queued by put()
+        """
+        delay = RETRY_DELAY
+        for attempt in range(1, WRITE_ATTEMPTS + 1):
+            try:
+                with profile_section():
+                    return self._write(batch)
+            except:
+                logging.exception('%s run() records=%d attempt=%d', CLASS_NAME,
+                                                            len(batch), attempt)
+                with self._lock:
+                    self._errors += 1
+
+            if attempt < WRITE_ATTEMPTS:
+                time.sleep(delay)
+                delay *= 2
+
+        logging.error('%s run() dropped records=%d', CLASS_NAME, len(batch))
+        return []
+
+    def _write(self, batch):
+        """
+        Writes the messages of a batch of records with one statement and
+        records their latest messages. Returns a list of (on_stored,
+        stored_time) for the records which asked to be told, see put().
+
+        batch (list): Records as queued by put()
+        """
+        messages = MessageBatch.concat(record[1] for record in batch)
+
+        failed_rows = self._db.add_message_batch(messages)
+        for failed_row in failed_rows:
+            logging.error("Message could not be inserted: %s", failed_row)
+        failed_keys = set((failed_row[0], failed_row[2]) for failed_row in failed_rows)
+
+        stored = []
+        for queued_at, device_batch, latest, on_stored in batch:
+            if latest is not None:
+                self._latest_state.update(*latest)
+
+            if on_stored is not None:
+                stored_time = device_batch.times[device_batch.newest()]
+                if failed_keys:
+                    failed_times = [time_sent for node_id, time_sent in device_batch.keys()
+                                            if (node_id, time_sent) in failed_keys]
+                    if failed_times:
+                        stored_time = min(failed_times) - 1
+                stored.append((on_stored, stored_time))
+
+        lag = time.monotonic() - batch[0][0]
+        with self._lock:
+            self._records_written += len(batch)
+            self._messages_written += len(messages) - len(failed_rows)
+            self._messages_failed += len(failed_rows)
+            self._batches_written += 1
+            self._last_lag = lag
+            self._max_lag = max(self._max_lag, lag)
+
+        return stored
+
+    def flush(self):
+        """
+        Blocks until every queued record has been written. A partial batch
+        is written at once instead of waiting for more records.
+        """
+        if self.is_alive():
+            self._queue.put(_FLUSH)
+        self._queue.join()
+
+    def close(self):
+        """
+        Writes every queued record and stops the thread.
+        """
+        if self.is_alive():
+            self._queue.put(_STOP)
+            self.join()
+
+    def stats(self):
+        """
+        Returns a dict of counters describing the writer. The lag is the time
+        in seconds between a record being queued and written.
+        """
+        with self._lock:
+            return {
+                'queue_depth': self._queue.qsize(),
+                'records_written': self._records_written,
+                'messages_written': self._messages_written,
+                'messages_failed': self._messages_failed,
+                'batches_written': self._batches_written,
+                'errors': self._errors,
+                'last_lag': self._last_lag,
+                'max_lag': self._max_lag,
+            }
@@ -0,0 +1,119 @@
+"""
+This module features the DeviceCatalog() class. The class caches the device
+types and devices of a Sigfox account, so that they are only requested again
+once the cache has expired.
+"""
+
+import threading
+import time
+
+from scraper.sigfox_parser import SigfoxParser
+from scraper.sigfox_scraper import DEVICE_TYPES_PATH, DEVICES_OF_TYPE_PATH
+
+DEFAULT_CATALOG_TTL = 3600
+
+
+class DeviceCatalog(object):
+
+    def __init__(self, scraper, ttl=DEFAULT_CATALOG_TTL, conditional=False):
+        """
+        Initializes the catalog for the account of the given scraper. The
+        devices are requested on first use.
+
+        scraper (scraper.SigfoxScraper): Scraper for the account
+        ttl (int): [OPTIONAL] Seconds the device list is reused for before it
+        is requested again
+        conditional (bool): [OPTIONAL] If True, the device list is refreshed
+        with conditional requests (ETag/If-Modified-Since), so that the
+        backend only sends responses which have changed
+        """
+        self._scraper = scraper
+        self._parser = SigfoxParser()
+        self._ttl = ttl
+        self._conditional = conditional
+
+        self._devices = None
+        self._expires_at = 0
+        # URL to (response, etag, last_modified) for conditional requests
+        self._responses = {}
+        self._lock = threading.Lock()
+
+    def _request(self, url, request, *args):
+        """
+        Returns the response for the given URL in dict format. In conditional
+        mode, the previous response is reused if the backend reports that it
+        has not been modified.
+
+        url (str): URL of the request
+        request (function): Makes the request when not in conditional mode
+        args: Arguments passed to request
+        """
+        if not self._conditional:
+            return request(*args)
+
+        previous, etag, last_modified = self._responses.get(url, (None, None, None))
+        if previous is None:
+            etag = None
+            last_modified = None
+
+        response, etag, last_modified = self._scraper.request_if_modified(url,
+                                                            etag, last_modified)
+        if response is None:
+            response = previous
+
+        self._responses[url] = (response, etag, last_modified)
+        return response
+
+    def _request_devices(self, device_type_id):
+        """
+        Returns the response listing the devices of a device type.
+
+        device_type_id (str): Device type ID as registered to Sigfox
+        """
+        return self._request(self._scraper.api_url + DEVICES_OF_TYPE_PATH % device_type_id,
+                                self._scraper.request_devices, device_type_id)
+
+    def refresh(self, executor=None):
+        """
+        Requests the device types and devices of the account again.
+
+        executor (concurrent.futures.Executor): [OPTIONAL] Requests the
+        devices of each device type in parallel
+        """
+        device_types = self._request(self._scraper.api_url + DEVICE_TYPES_PATH,
+                                        self._scraper.request_device_types)
+        device_type_ids = self._parser.retrieve_device_type_ids_from_response(device_types)
+
+        if executor is None:
+            responses = [self._request_devices(device_type_id)
+                                        for device_type_id in device_type_ids]
+        else:
+            responses = executor.map(self._request_devices, device_type_ids)
+
+        devices = []
+        for devices_of_type in responses:
+            devices.extend(self._parser.retrieve_device_id_from_response(devices_of_type))
+
+        self._devices = devices
+        self._expires_at = time.monotonic() + self._ttl
+
+    def devices(self, executor=None):
+        """
+        Returns a list of the Sigfox IDs of every device of the account,
+        requesting them again if the cache has expired.
+
+        executor (concurrent.futures.Executor): [OPTIONAL] Used if the
+        devices have to be requested
+        """
+        with self._lock:
+            if self._devices is None or time.monotonic() >= self._expires_at:
+                self.refresh(executor)
+
+            return list(self._devices)
+
+    def invalidate(self):
+        """
+        Forces the devices to be requested again on next use.
+        """
+        with self._lock:
+            self._devices = None
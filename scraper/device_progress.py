@@ -0,0 +1,82 @@
+"""
+This module features the DeviceProgress() class. The class moves the time of
+the newest stored message of a device forward once every batch of messages
+requested for it has been written, so that messages which were not written
+are requested again.
+"""
+
+import threading
+from functools import partial
+
+
+class DeviceProgress(object):
+
+    def __init__(self, latest_times, device):
+        """
+        Initializes the progress of one request of the messages of a device.
+
+        latest_times (dict): Sigfox ID to the time of the newest message
+        stored for that device, updated once every batch has been written
+        device (str): Sigfox ID of the device
+        """
+        self._latest_times = latest_times
+        self._device = device
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._newest_time = None
+        self._stored_time = None
+        self._finished = False
+
+    def expect(self, newest_time):
+        """
+        Records a batch of messages handed over to be written. Returns the
+        function to call with the time up to which the batch was stored, see
+        scraper.DatabaseWriter.put().
+
+        newest_time (int): Time of the newest message of the batch
+        """
+        with self._lock:
+            self._pending += 1
+            if self._newest_time is None or newest_time > self._newest_time:
+                self._newest_time = newest_time
+
+        return partial(self._stored, newest_time)
+
+    def _stored(self, newest_time, stored_time):
+        """
+        Records that a batch has been written.
+
+        newest_time (int): Time of the newest message of the batch
+        stored_time (int): Time up to which every message of the batch is
+        stored, earlier than newest_time if some of them failed
+        """
+        with self._lock:
+            self._pending -= 1
+            if stored_time < newest_time:
+                if self._stored_time is None or stored_time < self._stored_time:
+                    self._stored_time = stored_time
+            self._advance()
+
+    def finish(self):
+        """
+        Records that every batch of the device has been handed over.
+        """
+        with self._lock:
+            self._finished = True
+            self._advance()
+
+    def _advance(self):
+        """
+        Moves the time of the device forward once every batch is written.
+        A batch which is never reported keeps the time where it was.
+        """
+        if not self._finished or self._pending or self._newest_time is None:
+            return
+
+        stored_time = self._newest_time
+        if self._stored_time is not None:
+            stored_time = min(stored_time, self._stored_time)
+
+        current = self._latest_times.get(self._device)
+        if current is None or stored_time > current:
+            self._latest_times[self._device] = stored_time
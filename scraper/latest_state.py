@@ -0,0 +1,118 @@
+"""
+This module features the LatestState() class. The class collects the newest
+message of each node during an iteration and writes the latest messages and
+buoy statuses which have changed with one statement each.
+"""
+
+import logging
+import threading
+
+from scraper.message_parser import MessageParser
+
+BUTTON_CHAR_INDEX = 0
+
+
+class LatestState(object):
+
+    def __init__(self, db):
+        """
+        Initializes the stage for the given database.
+
+        db (scraper.PostgresInteraction): Connection to the database
+        """
+        self._db = db
+        self._message_parser = MessageParser()
+
+        # node_id to (decoded, time_sent) of the latest message
+        self._written_messages = {}
+        self._pending_messages = {}
+        # node_id to (time_checked, is_there) of the buoy
+        self._written_buoys = {}
+        self._pending_buoys = {}
+        self._lock = threading.Lock()
+
+    def update(self, node_id, message, time_sent):
+        """
+        Records a message as the latest message of a node, unless a newer
+        message has already been recorded. Nothing is written until flush().
+
+        node_id (int): ID of node as given by the database
+        message (str): Decoded message as sent to Sigfox
+        time_sent (int): Seconds since unix epoch the message was sent at
+        """
+        decoded = self._message_parser.decode(message)
+        if decoded is None:
+            logging.debug("Invalid message: %s", message)
+            return
+
+        is_there = self._message_parser.retrieve_button_pressed(message[BUTTON_CHAR_INDEX])
+
+        with self._lock:
+            pending = self._pending_messages.get(node_id)
+            if pending is not None and pending[1] >= time_sent:
+                return
+
+            if self._written_messages.get(node_id) != (decoded, time_sent):
+                self._pending_messages[node_id] = (decoded, time_sent)
+            else:
+                self._pending_messages.pop(node_id, None)
+
+            if self._written_buoys.get(node_id) != (time_sent, is_there):
+                self._pending_buoys[node_id] = (time_sent, is_there)
+            else:
+                self._pending_buoys.pop(node_id, None)
+
+    def flush(self):
+        """
+        Writes every latest message and buoy status which changed since the
+        last flush, using one statement for each table. The ones which could
+        not be written are kept for the next flush, unless a newer message of
+        the node has been recorded since.
+        """
+        with self._lock:
+            pending_messages = self._pending_messages
+            pending_buoys = self._pending_buoys
+            self._pending_messages = {}
+            self._pending_buoys = {}
+
+        message_rows = []
+        for node_id, (decoded, time_sent) in pending_messages.items():
+            message_rows.append((node_id, ) + decoded + (time_sent, ))
+
+        try:
+            failed_rows = self._db.add_latest_messages(message_rows)
+        except:
+            logging.exception("Latest messages could not be written")
+            failed_rows = message_rows
+
+        failed = set(row[0] for row in failed_rows)
+        with self._lock:
+            for node_id, state in pending_messages.items():
+                if node_id not in failed:
+                    self._written_messages[node_id] = state
+                    continue
+
+                newer = self._pending_messages.get(node_id)
+                if newer is None or newer[1] < state[1]:
+                    self._pending_messages[node_id] = state
+
+        buoy_rows = []
+        for node_id, (time_checked, is_there) in pending_buoys.items():
+            buoy_rows.append((node_id, time_checked, is_there))
+
+        try:
+            failed_rows = self._db.update_buoys_checked(buoy_rows)
+        except:
+            logging.exception("Buoy statuses could not be written")
+            failed_rows = buoy_rows
+
+        failed = set(row[0] for row in failed_rows)
+        with self._lock:
+            for node_id, state in pending_buoys.items():
+                if node_id not in failed:
+                    self._written_buoys[node_id] = state
+                    continue
+
+                newer = self._pending_buoys.get(node_id)
+                if newer is None or newer[0] < state[0]:
+                    self._pending_buoys[node_id] = state
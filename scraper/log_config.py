@@ -0,0 +1,117 @@
+"""
+This module sets up logging for the scraper. Records are handed through a
+queue to a background thread, which formats them and writes them to a file
+rotated by size, so that logging does not block the thread which logs. Debug
+records which repeat often can be rate limited.
+"""
+
+import logging
+import logging.handlers
+import queue
+import threading
+import time
+
+LOG_FORMAT = '%(asctime)s %(levelname)s %(threadName)s %(name)s: %(message)s'
+DEFAULT_MAX_BYTES = 10 * 1024 * 1024
+DEFAULT_BACKUP_COUNT = 5
+DEFAULT_RATE_LIMIT = 100
+DEFAULT_RATE_INTERVAL = 60
+
+
+class LazyQueueHandler(logging.handlers.QueueHandler):
+    """
+    Queue handler which leaves the formatting of records to the thread which
+    writes them, instead of formatting them in the thread which logs.
+    """
+
+    def prepare(self, record):
+        return record
+
+
+class RateLimitFilter(logging.Filter):
+
+    def __init__(self, limit=DEFAULT_RATE_LIMIT, interval=DEFAULT_RATE_INTERVAL,
+                                                            level=logging.DEBUG):
+        """
+        Initializes a filter which lets through at most limit records with the
+        same unformatted message in each interval. Records above the given
+        level are never limited. The first record after a limited interval
+        reports how many were dropped.
+
+        limit (int): [OPTIONAL] Records let through per message per interval
+        interval (float): [OPTIONAL] Length of an interval in seconds
+        level (int): [OPTIONAL] Highest level which is limited
+        """
+        super().__init__()
+        self._limit = limit
+        self._interval = interval
+        self._level = level
+        # (logger name, message) to [interval start, count, dropped]
+        self._windows = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if record.levelno > self._level:
+            return True
+
+        key = (record.name, record.msg)
+        now = time.monotonic()
+        with self._lock:
+            window = self._windows.get(key)
+            if window is None or now - window[0] >= self._interval:
+                dropped = window[2] if window is not None else 0
+                self._windows[key] = [now, 1, 0]
+                if dropped:
+                    record.msg = '%s [%d similar records dropped]' % (record.msg, dropped)
+                return True
+
+            if window[1] < self._limit:
+                window[1] += 1
+                return True
+
+            window[2] += 1
+            return False
+
+
+def configure_logging(filename, level=logging.DEBUG, max_bytes=DEFAULT_MAX_BYTES,
+                        backup_count=DEFAULT_BACKUP_COUNT, rate_limit=DEFAULT_RATE_LIMIT,
+                        rate_interval=DEFAULT_RATE_INTERVAL):
+    """
+    Sends the records of the root logger through a queue to a file which is
+    rotated by size. Returns the listener writing the records; it must be
+    stopped with stop() before exiting so that queued records are written.
+    Queue handlers already on the root logger are replaced, such as the one a
+    forked worker process inherits from its parent.
+
+    filename (str): File to write the log to
+    level (int): [OPTIONAL] Lowest level which is logged
+    max_bytes (int): [OPTIONAL] Size at which the file is rotated
+    backup_count (int): [OPTIONAL] Number of rotated files kept
+    rate_limit (int): [OPTIONAL] Debug records let through per message per
+    interval, or None to keep every record
+    rate_interval (float): [OPTIONAL] Length of an interval in seconds
+    """
+    file_handler = logging.handlers.RotatingFileHandler(filename, maxBytes=max_bytes,
+                                                        backupCount=backup_count)
+    file_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+
+    log_queue = queue.Queue()
+    queue_handler = LazyQueueHandler(log_queue)
+    if rate_limit is not None:
+        queue_handler.addFilter(RateLimitFilter(rate_limit, rate_interval))
+
+    root = logging.getLogger()
+    # Nothing reads the queue of an inherited handler in a forked process,
+    # so it would keep every record
+    for handler in root.handlers[:]:
+        if isinstance(handler, logging.handlers.QueueHandler):
+            root.removeHandler(handler)
+            handler.close()
+
+    root.setLevel(level)
+    root.addHandler(queue_handler)
+
+    listener = logging.handlers.QueueListener(log_queue, file_handler,
+                                                respect_handler_level=True)
+    listener.start()
+    return listener
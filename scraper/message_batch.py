@@ -0,0 +1,149 @@
+"""
+This module features the MessageBatch() class. The class holds many messages
+column by column, so that a page of messages moves from the parsers to the
+database without a tuple per message, and can be written to Postgres as a
+COPY buffer.
+"""
+
+import io
+from array import array
+
+NODE_ID_TYPE = 'q'
+TIME_TYPE = 'q'
+
+# Characters which must be escaped in the COPY text format
+COPY_ESCAPES = str.maketrans({
+    '\\': '\\\\',
+    '\t': '\\t',
+    '\n': '\\n',
+    '\r': '\\r',
+})
+COPY_ROW = '%d\t%s\t%d\n'
+
+
+class MessageBatch(object):
+
+    __slots__ = ('node_ids', 'raw', 'messages', 'times', 'button_pressed',
+                    'temperature_sensed', 'vibration_sensed', 'temperatures',
+                    'vibrations')
+
+    def __init__(self, node_ids=None, raw=None, messages=None, times=None):
+        """
+        Initializes a batch from its columns, which must all have the same
+        length. The decoded sensor columns are None until they are filled by
+        MessageParser.decode_batch().
+
+        node_ids (array): [OPTIONAL] ID of the node of each message
+        raw (list): [OPTIONAL] Hex encoded payload of each message
+        messages (list): [OPTIONAL] Decoded payload of each message
+        times (array): [OPTIONAL] Seconds since unix epoch of each message
+        """
+        self.node_ids = node_ids if node_ids is not None else array(NODE_ID_TYPE)
+        self.raw = raw if raw is not None else []
+        self.messages = messages if messages is not None else []
+        self.times = times if times is not None else array(TIME_TYPE)
+
+        self.button_pressed = None
+        self.temperature_sensed = None
+        self.vibration_sensed = None
+        self.temperatures = None
+        self.vibrations = None
+
+    def __len__(self):
+        return len(self.times)
+
+    def __repr__(self):
+        return 'MessageBatch(%d messages)' % len(self)
+
+    @classmethod
+    def from_rows(cls, rows):
+        """
+        Returns a batch of (node_id, message, time_sent) rows, for callers
+        which still build rows. The raw column holds the decoded messages.
+
+        rows (list): Tuples of (node_id, message, time_sent)
+        """
+        if not rows:
+            return cls()
+
+        node_ids, messages, times = zip(*rows)
+        messages = list(messages)
+        return cls(array(NODE_ID_TYPE, node_ids), messages, messages,
+                                                    array(TIME_TYPE, times))
+
+    @classmethod
+    def concat(cls, batches):
+        """
+        Returns one batch holding the messages of every given batch, in
+        order. The decoded sensor columns are not kept.
+
+        batches (list): MessageBatch instances
+        """
+        batch = cls()
+        for other in batches:
+            batch.node_ids.extend(other.node_ids)
+            batch.raw.extend(other.raw)
+            batch.messages.extend(other.messages)
+            batch.times.extend(other.times)
+
+        return batch
+
+    def assign_node_id(self, node_id):
+        """
+        Sets the node ID of every message, for a batch of a single device.
+
+        node_id (int): ID of the node as given by the database
+        """
+        self.node_ids = array(NODE_ID_TYPE, [node_id]) * len(self)
+
+    def take(self, indices):
+        """
+        Returns a new batch holding the messages at the given indices. The
+        decoded sensor columns are kept if they have been filled.
+
+        indices (list): Indices of the messages to keep, in order
+        """
+        batch = MessageBatch(array(NODE_ID_TYPE, [self.node_ids[i] for i in indices]),
+                            [self.raw[i] for i in indices],
+                            [self.messages[i] for i in indices],
+                            array(TIME_TYPE, [self.times[i] for i in indices]))
+
+        if self.button_pressed is not None:
+            batch.button_pressed = [self.button_pressed[i] for i in indices]
+            batch.temperature_sensed = [self.temperature_sensed[i] for i in indices]
+            batch.vibration_sensed = [self.vibration_sensed[i] for i in indices]
+            batch.temperatures = [self.temperatures[i] for i in indices]
+            batch.vibrations = [self.vibrations[i] for i in indices]
+
+        return batch
+
+    def newest(self):
+        """
+        Returns the index of the newest message, or None if the batch is
+        empty.
+        """
+        if not self.times:
+            return None
+        return max(range(len(self.times)), key=self.times.__getitem__)
+
+    def keys(self):
+        """
+        Returns an iterator of the (node_id, time_sent) key of each message.
+        """
+        return zip(self.node_ids, self.times)
+
+    def rows(self):
+        """
+        Returns a list of (node_id, message, time_sent) tuples, for the
+        methods which take rows.
+        """
+        return list(zip(self.node_ids, self.messages, self.times))
+
+    def copy_buffer(self):
+        """
+        Returns a file object holding the (node_id, message_text, time_sent)
+        columns in the Postgres COPY text format, ready for copy_expert().
+        """
+        messages = [message.translate(COPY_ESCAPES) for message in self.messages]
+        data = ''.join(map(COPY_ROW.__mod__, zip(self.node_ids, messages, self.times)))
+        return io.StringIO(data)
@@ -0,0 +1,77 @@
+"""
+This module features the MessageDeduplicator() class. The class remembers the
+(node_id, time_sent) keys of recently stored messages, so that messages which
+are delivered again, such as at the edges of overlapping requests or after a
+restart, are skipped before they reach the database.
+"""
+
+import threading
+from collections import OrderedDict
+
+DEFAULT_CAPACITY = 100000
+
+NODE_ID_INDEX = 0
+TIME_INDEX = 2
+
+
+class MessageDeduplicator(object):
+
+    def __init__(self, capacity=DEFAULT_CAPACITY):
+        """
+        Initializes an empty set of keys.
+
+        capacity (int): [OPTIONAL] Most keys remembered. The least recently
+        seen keys are forgotten first
+        """
+        self._capacity = capacity
+        # (node_id, time_sent) to None, least recently seen first
+        self._keys = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._keys)
+
+    def filter(self, rows):
+        """
+        Returns the rows whose keys have not been seen before, including
+        earlier in the same list, and remembers their keys.
+
+        rows (list): Tuples of (node_id, message, time_sent)
+        """
+        keys = [(row[NODE_ID_INDEX], row[TIME_INDEX]) for row in rows]
+        return [rows[index] for index in self.filter_keys(keys)]
+
+    def filter_keys(self, keys):
+        """
+        Returns the indices of the (node_id, time_sent) keys which have not
+        been seen before, including earlier in the same list, and remembers
+        them.
+
+        keys (iterable): (node_id, time_sent) tuples, such as the keys() of
+        a scraper.MessageBatch
+        """
+        new_indices = []
+        with self._lock:
+            for index, key in enumerate(keys):
+                if key in self._keys:
+                    self._keys.move_to_end(key)
+                    continue
+
+                self._keys[key] = None
+                new_indices.append(index)
+
+            while len(self._keys) > self._capacity:
+                self._keys.popitem(last=False)
+
+        return new_indices
+
+    def forget(self, rows):
+        """
+        Forgets the keys of rows which could not be stored, so that they are
+        not skipped when they are delivered again.
+
+        rows (list): Tuples of (node_id, message, time_sent)
+        """
+        with self._lock:
+            for row in rows:
+                self._keys.pop((row[NODE_ID_INDEX], row[TIME_INDEX]), None)
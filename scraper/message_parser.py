@@ -1,4 +1,76 @@
 import logging
+import string
+from itertools import product
+
+ZERO_CHAR = 'A'
+ONE_CHAR = 'B'
+TWO_CHAR = 'C'
+THREE_CHAR = 'D'
+FOUR_CHAR = 'E'
+FIVE_CHAR = 'F'
+TEN_CHAR = 'G'
+FIFTEEN_CHAR = 'H'
+TWENTY_CHAR = 'I'
+TWENTY_FIVE_CHAR = 'J'
+THIRTY_CHAR = 'K'
+THIRTY_FIVE_CHAR = 'L'
+FORTY_CHAR = 'M'
+GREATER_FORTY_CHAR = 'N'
+
+TEMPERATURE_VALUES = {
+    ZERO_CHAR: 0,
+    ONE_CHAR: 1,
+    TWO_CHAR: 2,
+    THREE_CHAR: 3,
+    FOUR_CHAR: 4,
+    FIVE_CHAR: 5,
+    TEN_CHAR: 10,
+    FIFTEEN_CHAR: 15,
+    TWENTY_CHAR: 20,
+    TWENTY_FIVE_CHAR: 25,
+    THIRTY_CHAR: 30,
+    THIRTY_FIVE_CHAR: 35,
+    FORTY_CHAR: 40,
+    GREATER_FORTY_CHAR: 50
+}
+
+ZERO_READING = 'Z'
+TEN_READING = 'B'
+TWENTY_READING = 'C'
+THIRTY_READING = 'D'
+FORTY_READING = 'E'
+FIFTY_READING = 'F'
+SIXTY_READING = 'G'
+SEVENTY_READING = 'H'
+EIGHTY_READING = 'I'
+NINETY_READING = 'J'
+HUNDRED_READING = 'K'
+OFF_SCALE_READING = 'L'
+
+VIBRATION_VALUES = {
+    ZERO_READING: 0.00,
+    TEN_READING: 0.10,
+    TWENTY_READING: 0.20,
+    THIRTY_READING: 0.30,
+    FORTY_READING: 0.40,
+    FIFTY_READING: 0.50,
+    SIXTY_READING: 0.60,
+    SEVENTY_READING: 0.70,
+    EIGHTY_READING: 0.80,
+    NINETY_READING: 0.90,
+    HUNDRED_READING: 1.00,
+    OFF_SCALE_READING: 2.00
+}
+
+BUTTON_CHARS = 'BN'
+# Every character a sensor could be encoded as; payloads made of other
+# characters are decoded without the lookup table
+SENSOR_CHARS = string.ascii_letters
+
+BUTTON_CHAR_INDEX = 0
+TEMPERATURE_CHAR_INDEX = 1
+VIBRATION_CHAR_INDEX = 2
+APPROPRIATE_MESSAGE_LENGTH = 3
 
 class MessageParser(object):
 
@@ -61,45 +133,13 @@ class MessageParser(object):
 
         char (str): Character from message
         """
-        ZERO_CHAR = 'A'
-        ONE_CHAR = 'B'
-        TWO_CHAR = 'C'
-        THREE_CHAR = 'D'
-        FOUR_CHAR = 'E'
-        FIVE_CHAR = 'F'
-        TEN_CHAR = 'G'
-        FIFTEEN_CHAR = 'H'
-        TWENTY_CHAR = 'I'
-        TWENTY_FIVE_CHAR = 'J'
-        THIRTY_CHAR = 'K'
-        THIRTY_FIVE_CHAR = 'L'
-        FORTY_CHAR = 'M'
-        GREATER_FORTY_CHAR = 'N'
-
-        map_values = {
-            ZERO_CHAR: 0,
-            ONE_CHAR: 1,
-            TWO_CHAR: 2,
-            THREE_CHAR: 3,
-            FOUR_CHAR: 4,
-            FIVE_CHAR: 5,
-            TEN_CHAR: 10,
-            FIFTEEN_CHAR: 15,
-            TWENTY_CHAR: 20,
-            TWENTY_FIVE_CHAR: 25,
-            THIRTY_CHAR: 30,
-            THIRTY_FIVE_CHAR: 35,
-            FORTY_CHAR: 40,
-            GREATER_FORTY_CHAR: 50
-        }
-
         value = -127
 
-        if char.upper() in map_values:
-            value = map_values[char]
-    
-        if char.islower():
-            value = value * -1
+        if char.upper() in TEMPERATURE_VALUES:
+            value = TEMPERATURE_VALUES[char.upper()]
+
+            if char.islower():
+                value = value * -1
         
         return value
 
@@ -109,38 +149,10 @@ class MessageParser(object):
 
         char (str): Character from message
         """
-        ZERO_READING = 'Z'
-        TEN_READING = 'B'
-        TWENTY_READING = 'C'
-        THIRTY_READING = 'D'
-        FORTY_READING = 'E'
-        FIFTY_READING = 'F'
-        SIXTY_READING = 'G'
-        SEVENTY_READING = 'H'
-        EIGHTY_READING = 'I'
-        NINETY_READING = 'J'
-        HUNDRED_READING = 'K'
-        OFF_SCALE_READING = 'L'
-
-        map_values = {
-            ZERO_READING: 0.00,
-            TEN_READING: 0.10,
-            TWENTY_READING: 0.20,
-            THIRTY_READING: 0.30,
-            FORTY_READING: 0.40,
-            FIFTY_READING: 0.50,
-            SIXTY_READING: 0.60,
-            SEVENTY_READING: 0.70,
-            EIGHTY_READING: 0.80,
-            NINETY_READING: 0.90,
-            HUNDRED_READING: 1.00,
-            OFF_SCALE_READING: 2.00
-        }
-
         value = 0.000
 
-        if char in map_values:
-            value = map_values[char]
+        if char in VIBRATION_VALUES:
+            value = VIBRATION_VALUES[char]
         
         return value
 
@@ -175,6 +187,79 @@ class MessageParser(object):
         return vibration_value
 
 
+    def decode_without_table(self, message):
+        """
+        Decodes a message character by character. Returns a tuple of
+        (button_pressed, temp_sensed, vib_sensed, temperature, vibration),
+        or None if the message is not valid.
+
+        message (str): Decoded message as sent to Sigfox
+        """
+        if len(message) != APPROPRIATE_MESSAGE_LENGTH:
+            return None
+
+        button_char = message[BUTTON_CHAR_INDEX]
+        temperature_char = message[TEMPERATURE_CHAR_INDEX]
+        vibration_char = message[VIBRATION_CHAR_INDEX]
+
+        button_pressed = self.retrieve_button_pressed(button_char)
+        if button_pressed == -1:
+            return None
+
+        temperature_sensed = self.check_temp_sensed(temperature_char)
+        temperature_number = self.calculate_temperature_value(
+                                    temperature_char, temperature_sensed)
+
+        vibration_sensed = self.check_vibration_sensed(vibration_char)
+        vibration_value = self.calculate_vibration_value(
+                                    vibration_char, vibration_sensed)
+
+        return (button_pressed, temperature_sensed, vibration_sensed,
+                                        temperature_number, vibration_value)
+
+    def decode(self, message):
+        """
+        Decodes a message using the precomputed lookup table. Returns a tuple
+        of (button_pressed, temp_sensed, vib_sensed, temperature, vibration),
+        or None if the message is not valid.
+
+        message (str): Decoded message as sent to Sigfox
+        """
+        decoded = DECODE_TABLE.get(message)
+        if decoded is None:
+            decoded = self.decode_without_table(message)
+
+        return decoded
+
+    def decode_many(self, messages):
+        """
+        Decodes a list of messages at once. Returns a tuple of five lists,
+        (button_pressed, temp_sensed, vib_sensed, temperature, vibration),
+        each holding one value per message. Every column holds None for
+        messages which are not valid.
+
+        messages (list): Decoded messages as sent to Sigfox
+        """
+        decoded = [DECODE_TABLE.get(message) or self.decode_without_table(message)
+                                                        or INVALID_DECODE
+                                                        for message in messages]
+        if not decoded:
+            return ([], [], [], [], [])
+
+        return tuple(list(column) for column in zip(*decoded))
+
+    def decode_batch(self, batch):
+        """
+        Fills the decoded sensor columns of a MessageBatch from its decoded
+        messages. Every column holds None for messages which are not valid.
+
+        batch (scraper.MessageBatch): Batch to decode
+        """
+        batch.button_pressed, batch.temperature_sensed, batch.vibration_sensed, \
+                batch.temperatures, batch.vibrations = self.decode_many(batch.messages)
+
+        return batch
+
     def insert_message_to_latest_message(self, message, db, node_id, seconds_since_unix_epoch):
         """
         Inserts relevant data for a message into the database, with given
@@ -185,30 +270,34 @@ class MessageParser(object):
         communication with database
         node_id (str): ID of node as given by the database
         """
-        BUTTON_CHAR_INDEX = 0
-        TEMPERATURE_CHAR_INDEX = 1
-        VIBRATION_CHAR_INDEX = 2
-        APPROPRIATE_MESSAGE_LENGTH = 3
-
         if len(message) == APPROPRIATE_MESSAGE_LENGTH:
 
-            button_char = message[BUTTON_CHAR_INDEX]
-            temperature_char = message[TEMPERATURE_CHAR_INDEX]
-            vibration_char = message[VIBRATION_CHAR_INDEX]
-            
-            button_pressed = self.retrieve_button_pressed(button_char)
-            if button_pressed != -1:
-
-                temperature_sensed = self.check_temp_sensed(temperature_char)
-                temperature_number = self.calculate_temperature_value(
-                                            temperature_char, temperature_sensed)  
-
-                vibration_sensed = self.check_vibration_sensed(vibration_char)
-                vibration_value = self.calculate_vibration_value(
-                                            vibration_char, vibration_sensed)
-                
+            decoded = self.decode(message)
+            if decoded is not None:
+                button_pressed, temperature_sensed, vibration_sensed, \
+                                    temperature_number, vibration_value = decoded
+
                 db.add_latest_message(node_id, button_pressed, temperature_sensed, 
                     vibration_sensed, temperature_number, vibration_value, seconds_since_unix_epoch)
 
         else:
-            logging.debug("Invalid message: %s" % (message))
+            logging.debug("Invalid message: %s", message)
+
+
+def build_decode_table():
+    """
+    Returns a dict of every valid message made of the known characters to
+    its decoded (button_pressed, temp_sensed, vib_sensed, temperature,
+    vibration) tuple.
+    """
+    message_parser = MessageParser()
+
+    table = {}
+    for chars in product(BUTTON_CHARS, SENSOR_CHARS, SENSOR_CHARS):
+        message = ''.join(chars)
+        table[message] = message_parser.decode_without_table(message)
+
+    return table
+
+INVALID_DECODE = (None, None, None, None, None)
+DECODE_TABLE = build_decode_table()
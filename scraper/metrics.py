@@ -0,0 +1,203 @@
+"""
+This module features the Metrics() class, which keeps counters and timers for
+the scraper, and the MetricsServer() class, which serves them over HTTP in the
+Prometheus text format. METRICS is the instance shared by the whole process.
+"""
+
+import functools
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+METRICS_PATH = '/metrics'
+CONTENT_TYPE = 'text/plain; version=0.0.4'
+PREFIX = 'scraper_'
+
+
+def format_labels(labels):
+    """
+    Returns labels in the Prometheus text format, e.g. {account="a"}.
+
+    labels (tuple): Sorted (name, value) pairs
+    """
+    if not labels:
+        return ''
+
+    pairs = []
+    for name, value in labels:
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        pairs.append('%s="%s"' % (name, value))
+    return '{%s}' % ','.join(pairs)
+
+
+class Metrics(object):
+
+    def __init__(self):
+        """
+        Initializes empty counters and timers.
+        """
+        # (name, labels) to value
+        self._counters = {}
+        # (name, labels) to [count, total seconds, max seconds]
+        self._timers = {}
+        self._lock = threading.Lock()
+
+    def increment(self, name, value=1, **labels):
+        """
+        Adds value to a counter.
+
+        name (str): Name of the counter
+        value (int): [OPTIONAL] Amount to add
+        labels: Labels identifying the counter, e.g. account
+        """
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, seconds, **labels):
+        """
+        Records a duration for a timer.
+
+        name (str): Name of the timer
+        seconds (float): Duration to record
+        labels: Labels identifying the timer
+        """
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            timer = self._timers.get(key)
+            if timer is None:
+                self._timers[key] = [1, seconds, seconds]
+            else:
+                timer[0] += 1
+                timer[1] += seconds
+                timer[2] = max(timer[2], seconds)
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """
+        Context manager which records how long its body takes. If the body
+        raises an exception, the errors counter of the timer is incremented.
+
+        name (str): Name of the timer
+        labels: Labels identifying the timer
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        except:
+            self.increment(name + '_errors', **labels)
+            raise
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def timed(self, name, **labels):
+        """
+        Decorator which records each call of a function with timer().
+
+        name (str): Name of the timer
+        labels: Labels identifying the timer
+        """
+        def decorator(function):
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                with self.timer(name, **labels):
+                    return function(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def render(self):
+        """
+        Returns every counter and timer in the Prometheus text format.
+        """
+        with self._lock:
+            counters = sorted(self._counters.items())
+            timers = sorted((key, list(value)) for key, value in self._timers.items())
+
+        lines = []
+        typed = set()
+        for (name, labels), value in counters:
+            metric = PREFIX + name + '_total'
+            if metric not in typed:
+                lines.append('# TYPE %s counter' % metric)
+                typed.add(metric)
+            lines.append('%s%s %s' % (metric, format_labels(labels), value))
+
+        for (name, labels), (count, total, maximum) in timers:
+            metric = PREFIX + name + '_seconds'
+            if metric not in typed:
+                lines.append('# TYPE %s summary' % metric)
+                typed.add(metric)
+            lines.append('%s_count%s %d' % (metric, format_labels(labels), count))
+            lines.append('%s_sum%s %.6f' % (metric, format_labels(labels), total))
+
+        return '\n'.join(lines) + '\n'
+
+    def summary(self):
+        """
+        Returns a one line summary of every counter and timer, for the log.
+        """
+        with self._lock:
+            counters = sorted(self._counters.items())
+            timers = sorted((key, list(value)) for key, value in self._timers.items())
+
+        parts = []
+        for (name, labels), value in counters:
+            parts.append('%s%s=%s' % (name, format_labels(labels), value))
+
+        for (name, labels), (count, total, maximum) in timers:
+            parts.append('%s%s=%d calls/%.3fs avg/%.3fs max' % (name, format_labels(labels),
+                                                        count, total / count, maximum))
+
+        return ', '.join(parts)
+
+
+METRICS = Metrics()
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path.split('?')[0] != METRICS_PATH:
+            self.send_response(404)
+            self.end_headers()
+            return
+
+        content = self.server.metrics.render().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class MetricsServer(object):
+
+    def __init__(self, port, host='127.0.0.1', metrics=METRICS):
+        """
+        Initializes the server. It must be started with start().
+
+        port (int): Port to listen on
+        host (str): [OPTIONAL] Address to listen on, local only by default
+        metrics (scraper.Metrics): [OPTIONAL] Metrics to serve
+        """
+        self._server = ThreadingHTTPServer((host, port), MetricsHandler)
+        self._server.daemon_threads = True
+        self._server.metrics = metrics
+
+    def start(self):
+        """
+        Serves the metrics from a background thread.
+        """
+        thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        thread.start()
+
+    def stop(self):
+        """
+        Stops the server.
+        """
+        self._server.shutdown()
+        self._server.server_close()
@@ -0,0 +1,63 @@
+"""
+This module features the NodeRegistry() class. The class keeps the node ID
+of every Sigfox device in memory, so that each device does not need to be
+looked up in the database on every iteration.
+"""
+
+import threading
+
+NODE_ID_INDEX = 0
+SIGFOX_ID_INDEX = 1
+
+
+class NodeRegistry(object):
+
+    def __init__(self, db):
+        """
+        Initializes the registry for the given database. The nodes are
+        loaded on first use.
+
+        db (scraper.PostgresInteraction): Connection to the database
+        """
+        self._db = db
+        self._node_ids = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        """
+        Loads every (sigfox_id, node_id) pair from the database, streamed
+        so that the full result is never held at once.
+        """
+        node_ids = {}
+        for row in self._db.iter_all_nodes():
+            node_ids[row[SIGFOX_ID_INDEX]] = row[NODE_ID_INDEX]
+
+        self._node_ids = node_ids
+
+    def resolve(self, sigfox_id, is_active=False):
+        """
+        Returns the node ID for the given Sigfox ID. Devices which are not
+        yet known are inserted as nodes with the given status. Returns None
+        if the node could not be inserted.
+
+        sigfox_id (str): Given Sigfox ID, to identify the node
+        is_active (bool): [OPTIONAL] Status given to newly inserted nodes
+        """
+        with self._lock:
+            if self._node_ids is None:
+                self._load()
+
+            node_id = self._node_ids.get(sigfox_id)
+            if node_id is None:
+                node_id = self._db.add_node_returning_id(sigfox_id, is_active)
+                if node_id is not None:
+                    self._node_ids[sigfox_id] = node_id
+
+        return node_id
+
+    def invalidate(self):
+        """
+        Clears the registry, so that the nodes are loaded again on next use.
+        """
+        with self._lock:
+            self._node_ids = None
@@ -0,0 +1,233 @@
+"""
+This module features the PollScheduler() class. The class decides when each
+device should next be polled, based on how often it has sent messages, so
+that requests are spent on the devices which actually produce data.
+"""
+
+import heapq
+import threading
+import time
+from collections import deque
+
+DEFAULT_MIN_INTERVAL = 60
+DEFAULT_MAX_INTERVAL = 6 * 60 * 60
+DEFAULT_INTERVAL = 10 * 60
+# Devices whose button state just changed are polled again this soon
+DEFAULT_BUTTON_INTERVAL = 60
+# Seconds after a message is expected before the device is polled
+DEFAULT_SLACK = 30
+DEFAULT_BUDGET = 600
+DEFAULT_BUDGET_INTERVAL = 60
+HISTORY_LENGTH = 10
+
+BUTTON_CHAR_INDEX = 0
+
+
+class DeviceSchedule(object):
+
+    __slots__ = ('times', 'newest', 'button', 'button_changed', 'misses', 'next_poll')
+
+    def __init__(self):
+        self.times = deque(maxlen=HISTORY_LENGTH)
+        self.newest = None
+        self.button = None
+        self.button_changed = False
+        self.misses = 0
+        self.next_poll = 0
+
+
+class PollScheduler(object):
+
+    def __init__(self, min_interval=DEFAULT_MIN_INTERVAL, max_interval=DEFAULT_MAX_INTERVAL,
+                    default_interval=DEFAULT_INTERVAL, button_interval=DEFAULT_BUTTON_INTERVAL,
+                    slack=DEFAULT_SLACK, budget=DEFAULT_BUDGET,
+                    budget_interval=DEFAULT_BUDGET_INTERVAL):
+        """
+        Initializes an empty scheduler. All times are in seconds.
+
+        min_interval (float): [OPTIONAL] Shortest time between two polls
+        max_interval (float): [OPTIONAL] Longest time between two polls
+        default_interval (float): [OPTIONAL] Interval assumed for devices
+        without enough messages to estimate one
+        button_interval (float): [OPTIONAL] Time before a device whose
+        button state just changed is polled again
+        slack (float): [OPTIONAL] Time allowed for a message to arrive after
+        it is expected
+        budget (int): [OPTIONAL] Most polls started in each budget interval,
+        across every account
+        budget_interval (float): [OPTIONAL] Length of a budget interval
+        """
+        self._min_interval = min_interval
+        self._max_interval = max_interval
+        self._default_interval = default_interval
+        self._button_interval = button_interval
+        self._slack = slack
+        self._budget = budget
+        self._budget_interval = budget_interval
+
+        self._tokens = float(budget)
+        self._refilled_at = time.monotonic()
+
+        # (account, device) to DeviceSchedule
+        self._devices = {}
+        # Heap of (next_poll, account, device); stale entries are skipped
+        self._heap = []
+        self._lock = threading.Lock()
+
+    def _push(self, key, next_poll):
+        schedule = self._devices[key]
+        schedule.next_poll = next_poll
+        heapq.heappush(self._heap, (next_poll, key[0], key[1]))
+
+    def sync(self, account, devices):
+        """
+        Makes the devices of an account match the given list. New devices are
+        due immediately, and devices which are not listed are forgotten.
+
+        account (str): Login identifier of the Sigfox account
+        devices (list): Sigfox IDs of the devices of the account
+        """
+        now = time.monotonic()
+        devices = set(devices)
+        with self._lock:
+            for key in [key for key in self._devices if key[0] == account]:
+                if key[1] not in devices:
+                    del self._devices[key]
+
+            for device in devices:
+                key = (account, device)
+                if key not in self._devices:
+                    self._devices[key] = DeviceSchedule()
+                    self._push(key, now)
+
+    def _refill(self, now):
+        elapsed = now - self._refilled_at
+        self._refilled_at = now
+        self._tokens = min(self._budget, self._tokens +
+                                    elapsed * self._budget / self._budget_interval)
+
+    def due(self):
+        """
+        Removes the devices which are due from the schedule, as far as the
+        budget allows, and returns a dict of account to set of devices. The
+        devices must be given back with reschedule() once they are polled.
+        """
+        now = time.monotonic()
+        due = {}
+        with self._lock:
+            self._refill(now)
+            while self._heap and self._heap[0][0] <= now and self._tokens >= 1:
+                next_poll, account, device = heapq.heappop(self._heap)
+                schedule = self._devices.get((account, device))
+                if schedule is None or schedule.next_poll != next_poll:
+                    # Forgotten or rescheduled since this entry was pushed
+                    continue
+
+                schedule.next_poll = None
+                self._tokens -= 1
+                due.setdefault(account, set()).add(device)
+
+        return due
+
+    def seconds_until_due(self):
+        """
+        Returns the number of seconds until the next device is due, or None if
+        there are no devices.
+        """
+        now = time.monotonic()
+        with self._lock:
+            while self._heap:
+                next_poll, account, device = self._heap[0]
+                schedule = self._devices.get((account, device))
+                if schedule is not None and schedule.next_poll == next_poll:
+                    wait = max(0, next_poll - now)
+                    if self._tokens < 1:
+                        wait = max(wait, (1 - self._tokens) * self._budget_interval / self._budget)
+                    return wait
+                heapq.heappop(self._heap)
+
+        return None
+
+    def record_messages(self, account, device, batch):
+        """
+        Records the new messages of a device. The messages may be given in
+        any order and over several calls, such as one call per page of
+        messages; only messages newer than every one recorded before can
+        change the button state.
+
+        account (str): Login identifier of the Sigfox account
+        device (str): Sigfox ID of the device
+        batch (scraper.MessageBatch): New messages of the device
+        """
+        with self._lock:
+            schedule = self._devices.get((account, device))
+            if schedule is None or not len(batch):
+                return
+
+            for time_sent, message in sorted(zip(batch.times, batch.messages)):
+                schedule.times.append(time_sent)
+                if schedule.newest is not None and time_sent <= schedule.newest:
+                    continue
+                schedule.newest = time_sent
+
+                button = message[BUTTON_CHAR_INDEX] if message else None
+                if schedule.button is not None and button != schedule.button:
+                    schedule.button_changed = True
+                schedule.button = button
+
+            schedule.misses = -1
+
+    def estimate_interval(self, account, device):
+        """
+        Returns the estimated number of seconds between the messages of a
+        device: the median gap between its recent messages.
+
+        account (str): Login identifier of the Sigfox account
+        device (str): Sigfox ID of the device
+        """
+        with self._lock:
+            return self._estimate_interval(self._devices[(account, device)])
+
+    def _estimate_interval(self, schedule):
+        times = sorted(schedule.times)
+        gaps = sorted(later - earlier for earlier, later in zip(times, times[1:])
+                                                                if later > earlier)
+        if not gaps:
+            interval = self._default_interval
+        else:
+            interval = gaps[len(gaps) // 2]
+
+        return min(self._max_interval, max(self._min_interval, interval))
+
+    def reschedule(self, account, device):
+        """
+        Schedules the next poll of a device after it has been polled. The
+        poll is timed for the next expected message; each poll which finds
+        nothing new pushes the next one further back.
+
+        account (str): Login identifier of the Sigfox account
+        device (str): Sigfox ID of the device
+        """
+        now = time.monotonic()
+        wall_clock = time.time()
+        with self._lock:
+            key = (account, device)
+            schedule = self._devices.get(key)
+            if schedule is None:
+                return
+
+            interval = self._estimate_interval(schedule)
+            schedule.misses += 1
+
+            if schedule.button_changed:
+                delay = self._button_interval
+                schedule.button_changed = False
+            elif schedule.misses == 0 and schedule.newest is not None:
+                # New messages arrived, so poll when the next one is expected
+                expected = schedule.newest + interval + self._slack
+                delay = expected - wall_clock
+            else:
+                delay = interval * (schedule.misses + 1) / 2
+
+            delay = min(self._max_interval, max(self._min_interval, delay))
+            self._push(key, now + delay)
@@ -1,8 +1,96 @@
 from scraper.postgres_interface import PostgresInterface
+from scraper.postgres_interface import DEFAULT_MIN_CONNECTIONS, DEFAULT_MAX_CONNECTIONS
+from scraper.node_registry import NodeRegistry
+from scraper.message_dedup import MessageDeduplicator
+from scraper.sensor_rollup import SensorRollup, ROLLUP_PERIODS
+from scraper.metrics import METRICS
+
+import logging
+import threading
+
+CLASS_NAME = "scraper.PostgresInteraction: "
+MESSAGE_UNIQUE_INDEX = "message_node_id_time_sent_key"
+DEFAULT_DUPLICATE_BATCH_SIZE = 10000
+# Inserts of a message which fail before it is given up on, so that a message
+# the database always rejects does not hold back its device forever
+MAX_INSERT_ATTEMPTS = 3
+
+INSERT_MESSAGE = "insert_message"
+INSERT_MESSAGE_RETURNING = "insert_message_returning"
+UPSERT_LATEST_MESSAGE = "upsert_latest_message"
+UPDATE_BUOY_CHECKED = "update_buoy_checked"
+UPSERT_NODE = "upsert_node"
+
+MESSAGE_STAGING_TABLE = "message_staging"
+CREATE_MESSAGE_STAGING = """CREATE TEMPORARY TABLE IF NOT EXISTS %s (
+    node_id integer,
+    message_text text,
+    time_sent bigint)
+ON COMMIT DELETE ROWS""" % MESSAGE_STAGING_TABLE
+COPY_MESSAGE_STAGING = """COPY %s (node_id, message_text, time_sent)
+FROM STDIN""" % MESSAGE_STAGING_TABLE
+INSERT_STAGED_MESSAGES = """INSERT INTO message(node_id, message_text, time_sent, time_entered)
+SELECT node_id, message_text, to_timestamp(time_sent), current_timestamp
+FROM %s
+ON CONFLICT DO NOTHING
+RETURNING node_id, CAST(EXTRACT(EPOCH FROM time_sent) AS BIGINT)""" % MESSAGE_STAGING_TABLE
+
+CREATE_ROLLUP_TABLE = """CREATE TABLE IF NOT EXISTS %s (
+    node_id integer NOT NULL REFERENCES node (node_id) ON DELETE CASCADE,
+    period_start timestamp with time zone NOT NULL,
+    message_count integer NOT NULL,
+    button_presses integer NOT NULL,
+    temperature_count integer NOT NULL,
+    temperature_min integer,
+    temperature_max integer,
+    temperature_sum bigint NOT NULL,
+    vibration_count integer NOT NULL,
+    vibration_min double precision,
+    vibration_max double precision,
+    vibration_sum double precision NOT NULL,
+    PRIMARY KEY (node_id, period_start))"""
 
 class PostgresInteraction(PostgresInterface):
 
-    def __init__(self, db_name, db_user, db_password, host):
+    # The statements run for every message, planned once per connection
+    PREPARED_STATEMENTS = {
+        INSERT_MESSAGE: """INSERT INTO message(node_id, message_text, time_sent, time_entered)
+        VALUES ($1, $2, to_timestamp($3::double precision), current_timestamp)
+        ON CONFLICT DO NOTHING""",
+        INSERT_MESSAGE_RETURNING: """INSERT INTO message(node_id, message_text, time_sent, time_entered)
+        VALUES ($1, $2, to_timestamp($3::double precision), current_timestamp)
+        ON CONFLICT DO NOTHING
+        RETURNING 1""",
+        UPSERT_LATEST_MESSAGE: """INSERT INTO last_message(node_id, button_press,
+            temp_sensed, vib_sensed, temperature, vibration,
+            time_entered)
+        VALUES ($1, $2, $3, $4, $5, $6, to_timestamp($7::double precision))
+        ON CONFLICT (node_id) DO UPDATE
+        SET button_press = EXCLUDED.button_press,
+            temp_sensed = EXCLUDED.temp_sensed,
+            vib_sensed = EXCLUDED.vib_sensed,
+            temperature = EXCLUDED.temperature,
+            vibration = EXCLUDED.vibration,
+            time_entered = EXCLUDED.time_entered
+        WHERE last_message.time_entered < EXCLUDED.time_entered""",
+        UPDATE_BUOY_CHECKED: """UPDATE buoy
+        SET time_checked = to_timestamp($1::double precision),
+        at_location = $2
+        FROM node_buoy
+        WHERE buoy.buoy_id = node_buoy.buoy_id
+        AND node_buoy.node_id = $3
+        AND (buoy.time_checked IS NULL
+            OR buoy.time_checked < to_timestamp($1::double precision))""",
+        UPSERT_NODE: """INSERT INTO node (node_id, sigfox_id, active)
+        VALUES (default, $1, $2)
+        ON CONFLICT (sigfox_id) DO UPDATE
+        SET active = EXCLUDED.active
+        RETURNING node_id""",
+    }
+
+    def __init__(self, db_name, db_user, db_password, host, pooled=False,
+                    min_connections=DEFAULT_MIN_CONNECTIONS,
+                    max_connections=DEFAULT_MAX_CONNECTIONS):
         """
         Constructor for PostgresInteraction class. It requires the details to
         connect to the database, and will use the PostgresInterface() class
@@ -14,8 +102,19 @@ class PostgresInteraction(PostgresInterface):
         db_password (str): The password to authenticate the users access to the
         database.
         host (str): IP address of database system, to allow remote connections
+        pooled (bool): [OPTIONAL] Borrow connections from a process-wide pool
+        min_connections (int): [OPTIONAL] Minimum size of the pool
+        max_connections (int): [OPTIONAL] Maximum size of the pool
         """
-        super().__init__(db_name, db_user, db_password, host)
+        super().__init__(db_name, db_user, db_password, host, pooled,
+                                        min_connections, max_connections)
+        self.nodes = NodeRegistry(self)
+        self.dedup = MessageDeduplicator()
+        self.rollups = SensorRollup(self)
+
+        # (node_id, time_sent) to the failed inserts of the message
+        self._insert_failures = {}
+        self._insert_failures_lock = threading.Lock()
 
     def add_node(self, sigfox_id, is_active):
         """
@@ -25,16 +124,32 @@ class PostgresInteraction(PostgresInterface):
         is_active (bool): True if the node is currently being listened for,
         False if the node is disabled.
         """
-        sql = """INSERT INTO node (node_id, sigfox_id, active)
-        VALUES (default, %s, %s)
-        ON CONFLICT (sigfox_id) DO UPDATE
-        SET active = %s"""
-        data = (sigfox_id, is_active, is_active)
-        if self.execute(sql, data):
+        data = (sigfox_id, is_active)
+        if self.execute_prepared(UPSERT_NODE, data):
             return True
         else:
             return False
 
+    def add_node_returning_id(self, sigfox_id, is_active):
+        """
+        Inserts a node into the database like add_node(), returning the node
+        ID in the same round trip. Returns None if the node could not be
+        inserted.
+
+        sigfox_id (str): Given Sigfox ID, to identify the node
+        is_active (bool): True if the node is currently being listened for,
+        False if the node is disabled.
+        """
+        data = (sigfox_id, is_active)
+        try:
+            rows = self.select_prepared(UPSERT_NODE, data)
+        except:
+            logging.exception('%s add_node_returning_id() sigfox_id=%s', 
+                                                            CLASS_NAME, sigfox_id)
+            return None
+
+        return rows[0][0]
+
     def set_node_status(self, status, sigfox_id):
         """
         Change the status of the node with the given Sigfox ID.
@@ -47,6 +162,7 @@ class PostgresInteraction(PostgresInterface):
         WHERE sigfox_id = %s"""
         data = (status, sigfox_id)
         if self.execute(sql, data):
+            self.nodes.invalidate()
             return True
         else:
             return False
@@ -61,6 +177,7 @@ class PostgresInteraction(PostgresInterface):
         WHERE sigfox_id = %s;"""
         data = (sigfox_id, )
         if self.execute(sql, data):
+            self.nodes.invalidate()
             return True
         else:
             return False
@@ -74,6 +191,34 @@ class PostgresInteraction(PostgresInterface):
         rows = self.select(sql)
         return rows
 
+    def iter_all_nodes(self):
+        """
+        Generator which yields every node from the database like
+        retrieve_all_nodes(), streamed from a server-side cursor.
+        """
+        sql =  """SELECT node_id, sigfox_id, active
+        FROM node"""
+        return self.iter_select(sql)
+
+    def iter_message_history(self, since=None):
+        """
+        Generator which yields every stored message, oldest first, as
+        (sigfox_id, seconds since unix epoch, message_text) tuples, streamed
+        from a server-side cursor.
+
+        since (int): [OPTIONAL] Only messages sent after this time, in
+        seconds since unix epoch, are yielded
+        """
+        sql = """SELECT node.sigfox_id,
+            CAST(EXTRACT(EPOCH FROM message.time_sent) AS BIGINT),
+            message.message_text
+        FROM message
+        JOIN node ON node.node_id = message.node_id
+        WHERE message.time_sent > to_timestamp(%s)
+        ORDER BY message.time_sent"""
+        data = (since if since is not None else -1, )
+        return self.iter_select(sql, data)
+
     def retrieve_node_by_sigfox_id(self, sigfox_id):
         """
         Retrieves specific node from database with given Sigfox ID.
@@ -87,66 +232,433 @@ class PostgresInteraction(PostgresInterface):
         rows = self.select(sql, data)
         return rows
 
+    def retrieve_latest_message_times(self):
+        """
+        Retrieves the time of the newest message stored for each node. The
+        returned value is a dict of Sigfox ID to seconds since unix epoch.
+        """
+        sql = """SELECT node.sigfox_id,
+            CAST(EXTRACT(EPOCH FROM MAX(message.time_sent)) AS BIGINT)
+        FROM message
+        JOIN node ON node.node_id = message.node_id
+        GROUP BY node.sigfox_id"""
+        rows = self.select(sql)
+
+        latest_times = {}
+        for sigfox_id, time_sent in rows:
+            latest_times[sigfox_id] = time_sent
+
+        return latest_times
+
+    def try_advisory_lock(self, key, subkey):
+        """
+        Tries to take a session level advisory lock without waiting. Returns
+        True if the lock is now held by this connection.
+
+        key (int): First key of the lock
+        subkey (int): Second key of the lock
+        """
+        sql = """SELECT pg_try_advisory_lock(%s, %s)"""
+        data = (key, subkey)
+        rows = self.select(sql, data)
+        return rows[0][0]
+
+    def retrieve_advisory_locks(self):
+        """
+        Returns the set of (key, subkey) pairs of the session level advisory
+        locks held by this connection, as taken by try_advisory_lock().
+        """
+        sql = """SELECT CAST(classid AS bigint), CAST(objid AS bigint)
+        FROM pg_locks
+        WHERE locktype = 'advisory'
+        AND objsubid = 2
+        AND granted
+        AND pid = pg_backend_pid()"""
+        locks = set()
+        for key, subkey in self.select(sql):
+            # The keys are shown as unsigned oids
+            if key >= 2 ** 31:
+                key -= 2 ** 32
+            if subkey >= 2 ** 31:
+                subkey -= 2 ** 32
+            locks.add((key, subkey))
+
+        return locks
+
+    def advisory_unlock(self, key, subkey):
+        """
+        Releases a session level advisory lock held by this connection.
+
+        key (int): First key of the lock
+        subkey (int): Second key of the lock
+        """
+        sql = """SELECT pg_advisory_unlock(%s, %s)"""
+        data = (key, subkey)
+        rows = self.select(sql, data)
+        return rows[0][0]
+
     def add_message(self, node_id, message, time_sent):
         """
         Inserts given values to database in the message table. This
-        will maintain historic messages for various auditorial checks
+        will maintain historic messages for various auditorial checks.
+        A message which is already stored for the node at the same time is
+        skipped.
 
         node_id (int): ID value for node to identify from the database
         message (str): Decoded message sent to sigfox
         time_sent (long): Seconds since unix epoch, to be converted on INSERT
         """
-        sql = """INSERT INTO message(node_id, message_text, time_sent, time_entered)
-        VALUES (%s, %s, to_timestamp(%s), current_timestamp)"""
         data = (node_id, message, time_sent)
-        if self.execute(sql, data):
+        if self.execute_prepared(INSERT_MESSAGE, data):
             return True
         else:
             return False
 
+    def add_messages(self, rows):
+        """
+        Inserts many messages into the message table with one statement, in
+        a single transaction. Returns a list of the rows which could not be
+        inserted; the remaining rows are still stored. Messages seen recently
+        are skipped without a round trip, and the rest are skipped by the
+        database if they are already stored.
+
+        rows (list): Tuples of (node_id, message, time_sent), with the same
+        meaning as the parameters of add_message()
+        """
+        new_rows = self.dedup.filter(rows)
+        if len(new_rows) < len(rows):
+            METRICS.increment('messages_duplicate', len(rows) - len(new_rows))
+        rows = new_rows
+
+        try:
+            failed = self.execute_many_prepared(INSERT_MESSAGE, rows)
+        except:
+            # Nothing was stored, so the rows must not be skipped as
+            # duplicates when they are written again
+            self.dedup.forget(rows)
+            raise
+        METRICS.increment('messages_ingested', len(rows) - len(failed))
+
+        failed_rows = []
+        for index in failed:
+            failed_rows.append(rows[index])
+
+        failed_rows = self._count_insert_failures(rows, failed_rows)
+        self.dedup.forget(failed_rows)
+        return failed_rows
+
+    def _count_insert_failures(self, rows, failed_rows):
+        """
+        Counts the failed inserts of each message and returns the failed rows
+        which are still to be retried. A message which has failed
+        MAX_INSERT_ATTEMPTS times is logged, counted as messages_abandoned
+        and reported as stored from then on. Messages which were inserted
+        are no longer counted.
+
+        rows (list): Tuples of (node_id, message, time_sent) written
+        failed_rows (list): The rows which could not be inserted
+        """
+        if not failed_rows and not self._insert_failures:
+            return failed_rows
+
+        failed_keys = set((row[0], row[2]) for row in failed_rows)
+        retried_rows = []
+        abandoned_rows = []
+        with self._insert_failures_lock:
+            if self._insert_failures:
+                for row in rows:
+                    key = (row[0], row[2])
+                    if key not in failed_keys:
+                        self._insert_failures.pop(key, None)
+
+            for row in failed_rows:
+                key = (row[0], row[2])
+                attempts = self._insert_failures.get(key, 0) + 1
+                if attempts < MAX_INSERT_ATTEMPTS:
+                    self._insert_failures[key] = attempts
+                    retried_rows.append(row)
+                else:
+                    self._insert_failures.pop(key, None)
+                    abandoned_rows.append(row)
+
+        for row in abandoned_rows:
+            logging.error('%s message abandoned after %d attempts: %s', CLASS_NAME,
+                                                        MAX_INSERT_ATTEMPTS, row)
+        if abandoned_rows:
+            METRICS.increment('messages_abandoned', len(abandoned_rows))
+
+        return retried_rows
+
+    def add_message_batch(self, batch):
+        """
+        Inserts a scraper.MessageBatch into the message table. The batch is
+        sent with COPY into a staging table and inserted from there in one
+        statement, converting the times on the server. Recently seen
+        messages are skipped like in add_messages(). If the batch cannot be
+        copied, its messages are inserted one statement each so that the
+        failing ones and the ones already stored can be told apart. The
+        messages inserted are added to the rollups, which are written when
+        they are flushed. Returns a list of the (node_id, message, time_sent)
+        rows which could not be inserted.
+
+        batch (scraper.MessageBatch): Messages to insert
+        """
+        new_indices = self.dedup.filter_keys(batch.keys())
+        if len(new_indices) < len(batch):
+            METRICS.increment('messages_duplicate', len(batch) - len(new_indices))
+            batch = batch.take(new_indices)
+
+        if not len(batch):
+            return []
+
+        try:
+            failed_rows = self._insert_message_batch(batch)
+        except:
+            # Nothing was stored, so the messages must not be skipped as
+            # duplicates when they are written again
+            self.dedup.forget(batch.rows())
+            raise
+
+        METRICS.increment('messages_ingested', len(batch) - len(failed_rows))
+        if failed_rows or self._insert_failures:
+            failed_rows = self._count_insert_failures(batch.rows(), failed_rows)
+        self.dedup.forget(failed_rows)
+        return failed_rows
+
+    def _insert_message_batch(self, batch):
+        """
+        Inserts the messages of a batch for add_message_batch(), adding the
+        ones inserted to the rollups. Returns a list of the rows which could
+        not be inserted.
+
+        batch (scraper.MessageBatch): Messages not seen recently
+        """
+        failed_rows = []
+        inserted = self.copy_insert(MESSAGE_STAGING_TABLE, CREATE_MESSAGE_STAGING,
+                                    COPY_MESSAGE_STAGING, batch.copy_buffer(),
+                                    INSERT_STAGED_MESSAGES)
+        if inserted is not None:
+            inserted = set(inserted)
+            self.rollups.add(batch.take([index for index, key in enumerate(batch.keys())
+                                                                if key in inserted]))
+        else:
+            inserted = []
+            for index, row in enumerate(batch.rows()):
+                try:
+                    # No row is returned if the message is already stored
+                    if self.select_prepared(INSERT_MESSAGE_RETURNING, row):
+                        inserted.append(index)
+                except:
+                    logging.exception('%s add_message_batch() row=%s', CLASS_NAME, row)
+                    failed_rows.append(row)
+
+            self.rollups.add(batch.take(inserted))
+
+        return failed_rows
+
+    def create_rollup_tables(self):
+        """
+        Creates the hourly and daily sensor rollup tables if they do not
+        exist. Returns True if they both exist.
+        """
+        created = True
+        for table, period in ROLLUP_PERIODS.values():
+            created = self.execute(CREATE_ROLLUP_TABLE % table, None) and created
+
+        return created
+
+    def upsert_rollups(self, table, rows):
+        """
+        Adds aggregates to a rollup table with one statement, combining them
+        with the aggregates already stored for the same node and period.
+        Returns a list of the rows which could not be stored.
+
+        table (str): Name of the rollup table
+        rows (list): Tuples of (node_id, period_start, message_count,
+        button_presses, temperature_count, temperature_min, temperature_max,
+        temperature_sum, vibration_count, vibration_min, vibration_max,
+        vibration_sum), with period_start in seconds since unix epoch
+        """
+        sql = """INSERT INTO %s AS rollup (node_id, period_start, message_count,
+            button_presses, temperature_count, temperature_min, temperature_max,
+            temperature_sum, vibration_count, vibration_min, vibration_max,
+            vibration_sum)
+        VALUES %%s
+        ON CONFLICT (node_id, period_start) DO UPDATE
+        SET message_count = rollup.message_count + EXCLUDED.message_count,
+            button_presses = rollup.button_presses + EXCLUDED.button_presses,
+            temperature_count = rollup.temperature_count + EXCLUDED.temperature_count,
+            temperature_min = LEAST(rollup.temperature_min, EXCLUDED.temperature_min),
+            temperature_max = GREATEST(rollup.temperature_max, EXCLUDED.temperature_max),
+            temperature_sum = rollup.temperature_sum + EXCLUDED.temperature_sum,
+            vibration_count = rollup.vibration_count + EXCLUDED.vibration_count,
+            vibration_min = LEAST(rollup.vibration_min, EXCLUDED.vibration_min),
+            vibration_max = GREATEST(rollup.vibration_max, EXCLUDED.vibration_max),
+            vibration_sum = rollup.vibration_sum + EXCLUDED.vibration_sum""" % table
+        template = """(%s, to_timestamp(%s), %s, %s, %s, %s::integer, %s::integer,
+            %s, %s, %s::double precision, %s::double precision, %s)"""
+        failed = self.execute_many(sql, rows, template)
+
+        return [rows[index] for index in failed]
+
+    def delete_rollups(self, node_id):
+        """
+        Deletes every rollup of a node, so that they can be rebuilt from the
+        message history.
+
+        node_id (int): ID of the node
+        """
+        succeeded = True
+        for table, period in ROLLUP_PERIODS.values():
+            sql = """DELETE FROM %s
+            WHERE node_id = %%s""" % table
+            succeeded = self.execute(sql, (node_id, )) and succeeded
+
+        return succeeded
+
+    def retrieve_message_history(self, node_id, after, before, limit):
+        """
+        Retrieves up to limit messages of a node sent after one time and
+        entered into the database before another, oldest first, as
+        (message_text, seconds since unix epoch) tuples. Passing the time of
+        the last message returned as after reads the next chunk.
+
+        node_id (int): ID of the node
+        after (int): Seconds since unix epoch, exclusive
+        before (int): Seconds since unix epoch the messages were entered
+        before
+        limit (int): Most messages returned
+        """
+        sql = """SELECT message_text, CAST(EXTRACT(EPOCH FROM time_sent) AS BIGINT)
+        FROM message
+        WHERE node_id = %s
+        AND time_sent > to_timestamp(%s)
+        AND time_entered < to_timestamp(%s)
+        ORDER BY time_sent
+        LIMIT %s"""
+        data = (node_id, after, before, limit)
+        return self.select(sql, data)
+
+    def remove_duplicate_messages(self, node_id, batch_size=DEFAULT_DUPLICATE_BATCH_SIZE):
+        """
+        Deletes up to batch_size duplicate messages of a node, keeping the
+        first stored copy of each (node_id, time_sent) pair. Returns the
+        number of messages deleted, or None if the statement failed.
+
+        node_id (int): ID of the node whose messages are checked
+        batch_size (int): [OPTIONAL] Most messages deleted by one statement
+        """
+        sql = """DELETE FROM message
+        WHERE ctid IN (
+            SELECT ctid
+            FROM (
+                SELECT ctid, row_number() OVER (
+                    PARTITION BY time_sent
+                    ORDER BY time_entered, ctid) AS copy
+                FROM message
+                WHERE node_id = %s
+            ) AS copies
+            WHERE copy > 1
+            LIMIT %s
+        )
+        RETURNING 1"""
+        data = (node_id, batch_size)
+        try:
+            rows = self.select(sql, data)
+        except:
+            logging.exception('%s remove_duplicate_messages() node_id=%s',
+                                                                CLASS_NAME, node_id)
+            return None
+
+        return len(rows)
+
+    def create_message_unique_index(self):
+        """
+        Creates the unique index on (node_id, time_sent) of the message
+        table without blocking writes. It can only be created once every
+        duplicate message has been removed; if it fails, the invalid index it
+        leaves behind must be dropped before trying again.
+        """
+        sql = """CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS %s
+        ON message (node_id, time_sent)""" % MESSAGE_UNIQUE_INDEX
+        return self.execute(sql, None)
+
     def add_latest_message(self, node_id, button_pressed, temperature_sensed, 
                                 vibration_sensed, temperature, vibration, time_sent):
         """
         Adds message details to database. The details of each sensor are 
-        decoded before being inserted into the database.
+        decoded before being inserted into the database. A stored message
+        which is not older than the given one is kept.
 
         node_id (int): ID of node as given by the database
         button_pressed (bool): True if the button is currently being pressed
         temperature (character): Encoded character value to be converted
         vibration (character): Encoded character value to be converted
         """
+        data = (node_id, button_pressed, temperature_sensed, vibration_sensed,
+                                                temperature, vibration, time_sent)
+        
+        return self.execute_prepared(UPSERT_LATEST_MESSAGE, data)
+
+    def add_latest_messages(self, rows):
+        """
+        Adds the latest message details of many nodes with one statement.
+        Each node may only appear once, and stored messages which are not
+        older are kept. Returns a list of the rows which could not be stored.
+
+        rows (list): Tuples of (node_id, button_pressed, temperature_sensed,
+        vibration_sensed, temperature, vibration, time_sent), with the same
+        meaning as the parameters of add_latest_message()
+        """
         sql = """INSERT INTO last_message(node_id, button_press, 
             temp_sensed, vib_sensed, temperature, vibration, 
             time_entered) 
-        VALUES (%s, %s, %s, %s, %s, %s, to_timestamp(%s))
+        VALUES %s
         ON CONFLICT (node_id) DO UPDATE
-        SET button_press = %s,
-            temp_sensed = %s,
-            vib_sensed = %s,
-            temperature = %s,
-            vibration = %s,
-            time_entered = to_timestamp(%s);"""
-        data = (node_id, button_pressed, temperature_sensed, vibration_sensed,
-                        temperature, vibration, time_sent, button_pressed, temperature_sensed,
-                        vibration_sensed, temperature, vibration, time_sent)
-        
-        return self.execute(sql, data)
+        SET button_press = EXCLUDED.button_press,
+            temp_sensed = EXCLUDED.temp_sensed,
+            vib_sensed = EXCLUDED.vib_sensed,
+            temperature = EXCLUDED.temperature,
+            vibration = EXCLUDED.vibration,
+            time_entered = EXCLUDED.time_entered
+        WHERE last_message.time_entered < EXCLUDED.time_entered;"""
+        template = "(%s, %s, %s, %s, %s, %s, to_timestamp(%s))"
+        failed = self.execute_many(sql, rows, template)
+
+        return [rows[index] for index in failed]
+
+    def update_buoys_checked(self, rows):
+        """
+        Updates the status of the buoys connected to many nodes with one
+        set-based statement. Buoys checked at a later time are left as they
+        are. Returns a list of the rows which could not be stored.
+
+        rows (list): Tuples of (node_id, time_checked, is_there), with the
+        same meaning as the parameters of update_buoy_checked_by_node_id()
+        """
+        sql = """UPDATE buoy
+        SET time_checked = to_timestamp(checked.time_checked),
+        at_location = checked.at_location
+        FROM node_buoy, (VALUES %s) AS checked(node_id, time_checked, at_location)
+        WHERE buoy.buoy_id = node_buoy.buoy_id
+        AND node_buoy.node_id = checked.node_id
+        AND (buoy.time_checked IS NULL
+            OR buoy.time_checked < to_timestamp(checked.time_checked))"""
+        template = "(%s::integer, %s::double precision, %s::boolean)"
+        failed = self.execute_many(sql, rows, template)
+
+        return [rows[index] for index in failed]
 
     def update_buoy_checked_by_node_id(self, time_checked, node_id, is_there):
         """
         If a node is connected to a buoy, the buoys latest status will
         be updated, along with a timestamp to show when it was last checked.
+        A buoy checked at a later time is left as it is.
 
         time_checked (int): Seconds since unix epoch. It is the time that the 
         node sent the message to be checked
         node_id (int): ID of node which sent the message.
         """
-        sql = """UPDATE buoy
-        SET time_checked = to_timestamp(%s),
-        at_location = %s
-        FROM node_buoy
-        WHERE buoy.buoy_id = node_buoy.buoy_id
-        AND node_buoy.node_id = %s"""
         data = (time_checked, is_there, node_id)
 
-        return self.execute(sql, data)
\ No newline at end of file
+        return self.execute_prepared(UPDATE_BUOY_CHECKED, data)
\ No newline at end of file
@@ -1,12 +1,101 @@
 import psycopg2
+import psycopg2.errors
+import psycopg2.extras
+import psycopg2.pool
+import itertools
 import logging
+import threading
+import weakref
+from contextlib import contextmanager
+
+from scraper.metrics import METRICS
 
 CONNECTION = "dbname=%s user=%s host=%s password=%s"
 CLASS_NAME = "scraper.PostgresInterface: "
+BATCH_SAVEPOINT = "batch_row"
+DEFAULT_MIN_CONNECTIONS = 1
+DEFAULT_MAX_CONNECTIONS = 10
+DEFAULT_FETCH_SIZE = 2000
+
+# Connection pools shared by every PostgresInterface in the process, keyed
+# by connection string
+_pools = {}
+_pools_lock = threading.Lock()
+
+# Connection to the set of names of the statements prepared on it. Prepared
+# statements belong to a database session, so a connection opened to
+# replace a broken one starts with none
+_prepared = weakref.WeakKeyDictionary()
+_prepared_lock = threading.Lock()
+# Connection to the set of names of the temporary tables created on it
+_staging_tables = weakref.WeakKeyDictionary()
+# Numbers the named cursors of iter_select()
+_cursor_ids = itertools.count()
+
+
+class BlockingConnectionPool(psycopg2.pool.ThreadedConnectionPool):
+    """
+    Thread safe connection pool which waits for a connection to be returned
+    when every connection is in use, instead of raising PoolError.
+    """
+
+    def __init__(self, min_connections, max_connections, *args, **kwargs):
+        self._available = threading.BoundedSemaphore(max_connections)
+        super().__init__(min_connections, max_connections, *args, **kwargs)
+
+    def getconn(self, key=None):
+        self._available.acquire()
+        try:
+            return super().getconn(key)
+        except:
+            self._available.release()
+            raise
+
+    def putconn(self, conn, key=None, close=False):
+        try:
+            super().putconn(conn, key, close)
+        finally:
+            self._available.release()
+
+
+def get_pool(connection_string, min_connections=DEFAULT_MIN_CONNECTIONS,
+                                max_connections=DEFAULT_MAX_CONNECTIONS):
+    """
+    Returns the process-wide connection pool for the given connection
+    string, creating it on first use.
+
+    connection_string (str): libpq connection string for the database
+    min_connections (int): Connections opened when the pool is created
+    max_connections (int): Most connections the pool will hold open
+    """
+    with _pools_lock:
+        pool = _pools.get(connection_string)
+        if pool is None:
+            pool = BlockingConnectionPool(min_connections, max_connections,
+                                                            connection_string)
+            _pools[connection_string] = pool
+
+    return pool
+
+def close_pools():
+    """
+    Closes every connection held by the process-wide connection pools.
+    """
+    with _pools_lock:
+        for pool in _pools.values():
+            pool.closeall()
+        _pools.clear()
+
 
 class PostgresInterface(object):
 
-    def __init__(self, db_name, db_user, db_password, host):
+    # Name to SQL of the statements which can be run with execute_prepared(),
+    # select_prepared() and execute_many_prepared(). Parameters are $1, $2...
+    PREPARED_STATEMENTS = {}
+
+    def __init__(self, db_name, db_user, db_password, host, pooled=False,
+                    min_connections=DEFAULT_MIN_CONNECTIONS,
+                    max_connections=DEFAULT_MAX_CONNECTIONS):
         """
         Initializes the PostgresInterface class. The class requires a database 
         name, user and password to connect to the database. The host allows for
@@ -18,17 +107,86 @@ class PostgresInterface(object):
         db_password (str): Password credential to access the database
         host (str): Host location of the database. Should be an IP address, or
             localhost
+        pooled (bool): [OPTIONAL] If True, connections are borrowed from a
+            process-wide pool, so the instance can be shared between threads
+        min_connections (int): [OPTIONAL] Minimum size of the pool
+        max_connections (int): [OPTIONAL] Maximum size of the pool
         """
+        self._conn = None
+        self._pool = None
+        self._lock = threading.RLock()
+        self._local = threading.local()
+
+        connection_string = CONNECTION % (db_name, db_user, host, db_password)
+        self._connection_string = connection_string
         try:
-            self._conn = psycopg2.connect(CONNECTION % (db_name, db_user, host, 
-                                                                db_password))
-            self._conn.autocommit = True
+            if pooled:
+                self._pool = get_pool(connection_string, min_connections,
+                                                            max_connections)
+            else:
+                self._conn = psycopg2.connect(connection_string)
+                self._conn.autocommit = True
         except:
-            logging.exception("%s db_name=%s, db_user=%s, host=%s" % 
-                                                                (CLASS_NAME, db_name, db_user, host))
+            logging.exception("%s db_name=%s, db_user=%s, host=%s", 
+                                                                CLASS_NAME, db_name, db_user, host)
             raise
 
-        self._cursor = self._conn.cursor()
+    @contextmanager
+    def connection(self):
+        """
+        Context manager which lends a connection for a unit of work. Nested
+        uses in the same thread share the connection already borrowed. In
+        pooled mode the connection is returned to the pool afterwards,
+        otherwise the single connection is locked for the unit of work.
+        """
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            yield conn
+            return
+
+        if self._pool is None:
+            with self._lock:
+                self._local.conn = self._conn
+                try:
+                    yield self._conn
+                finally:
+                    self._local.conn = None
+            return
+
+        conn = self._pool.getconn()
+        conn.autocommit = True
+        self._local.conn = conn
+        try:
+            yield conn
+        finally:
+            self._local.conn = None
+            self._pool.putconn(conn, close=bool(conn.closed))
+
+    def reconnect(self):
+        """
+        Replaces the connection of a non-pooled instance with a new one, such
+        as after the database session was lost. Everything which belonged to
+        the old session, like advisory locks, is gone.
+        """
+        if self._pool is not None:
+            return
+
+        with self._lock:
+            try:
+                self._conn.close()
+            except:
+                logging.exception('%s reconnect() close', CLASS_NAME)
+
+            self._conn = psycopg2.connect(self._connection_string)
+            self._conn.autocommit = True
+
+    def close(self):
+        """
+        Closes the connection of a non-pooled instance. Pooled connections
+        stay open for other users of the pool, see close_pools().
+        """
+        if self._conn is not None:
+            self._conn.close()
 
     def select(self, sql, data=None):
         """
@@ -37,10 +195,58 @@ class PostgresInterface(object):
         sql (str): Parameterized sql SELECT query
         data (tuple): Data to be inserted into sql string
         """
-        self._cursor.execute(sql, data)
-        rows = self._cursor.fetchall()
+        with METRICS.timer('postgres_statement', statement='select'):
+            with self.connection() as conn:
+                with conn.cursor() as cursor:
+                    cursor.execute(sql, data)
+                    rows = cursor.fetchall()
         return rows
 
+    def iter_select(self, sql, data=None, batch_size=DEFAULT_FETCH_SIZE, withhold=False):
+        """
+        Generator which yields every row of a SELECT query through a named
+        server-side cursor, fetching batch_size rows at a time, so that
+        large results are never held in memory at once. The connection is
+        borrowed until the generator is exhausted or closed.
+
+        By default the cursor lives in a transaction, so no other statement
+        may run on the connection from the same thread while iterating. With
+        withhold, the cursor is declared WITH HOLD instead and the connection
+        stays in autocommit mode, allowing other statements in between, at
+        the cost of the server keeping the result until the cursor is closed.
+
+        sql (str): Parameterized sql SELECT query
+        data (tuple): [OPTIONAL] Data to be inserted into sql string
+        batch_size (int): [OPTIONAL] Rows fetched from the server at once
+        withhold (bool): [OPTIONAL] Declare the cursor WITH HOLD
+        """
+        name = 'iter_select_%d' % next(_cursor_ids)
+        with self.connection() as conn:
+            if not withhold:
+                conn.autocommit = False
+            try:
+                with conn.cursor(name, withhold=withhold) as cursor:
+                    cursor.itersize = batch_size
+                    cursor.execute(sql, data)
+                    while True:
+                        rows = cursor.fetchmany(batch_size)
+                        if not rows:
+                            break
+
+                        METRICS.increment('postgres_rows_streamed', len(rows))
+                        for row in rows:
+                            yield row
+
+                if not withhold:
+                    conn.commit()
+            except:
+                if not withhold:
+                    conn.rollback()
+                raise
+            finally:
+                if not withhold:
+                    conn.autocommit = True
+
     def execute(self, sql, data):
         """
         Executes a standard statement (INSERT, UPDATE, etc.) with
@@ -49,16 +255,285 @@ class PostgresInterface(object):
         sql (str): Parameterized SQL statement
         data (tuple): Data to be inserted into the sql string
         """
+        with METRICS.timer('postgres_statement', statement='execute'), \
+                                                self.connection() as conn:
+            try:
+                with conn.cursor() as cursor:
+                    cursor.execute(sql, data)
+                return True
+            except psycopg2.IntegrityError:
+                # Should run in case of repeated UNIQUE table values
+                conn.rollback()
+                logging.exception('%s execute() sql=%s , data=%s', CLASS_NAME, sql, data)
+
+            except:
+                conn.rollback()
+                logging.exception('%s execute() sql=%s , data=%s', CLASS_NAME, sql, data)
+
+        METRICS.increment('postgres_statement_errors', statement='execute')
+        return False
+
+    def execute_many(self, sql, rows, template=None):
+        """
+        Executes a statement for many rows at once inside a single
+        transaction. The rows are sent as one multi-row VALUES list, so sql
+        must contain a single VALUES %s placeholder. If the statement fails,
+        every row is retried on its own so that the failing rows can be
+        reported without losing the rest of the batch. Returns a list of
+        the indices of rows which could not be executed.
+
+        sql (str): Parameterized SQL statement with a VALUES %s placeholder
+        rows (list): Tuples of data, one tuple per row
+        template (str): [OPTIONAL] Template for a single row of VALUES
+        """
+        failed = []
+        if not rows:
+            return failed
+
+        def run(cursor, batch):
+            psycopg2.extras.execute_values(cursor, sql, batch,
+                                        template=template, page_size=len(batch))
+
+        with METRICS.timer('postgres_statement', statement='execute_many'), \
+                                                self.connection() as conn:
+            failed = self._execute_transaction(conn, run, rows, sql)
+
+        if failed:
+            METRICS.increment('postgres_failed_rows', len(failed), statement='execute_many')
+        return failed
+
+    def _execute_transaction(self, conn, run, rows, description):
+        """
+        Runs a batch of rows inside a single transaction, returning a list
+        of the indices of failed rows.
+
+        conn (psycopg2.extensions.connection): Connection in autocommit mode
+        run (function): Executes a list of rows on a cursor
+        rows (list): Tuples of data, one tuple per row
+        description (str): Statement named in the log if the batch fails
+        """
+        conn.autocommit = False
+        try:
+            with conn.cursor() as cursor:
+                return self._execute_batch(conn, cursor, run, rows, description)
+        except:
+            conn.rollback()
+            logging.exception('%s execute_many() sql=%s', CLASS_NAME, description)
+            return list(range(len(rows)))
+        finally:
+            conn.autocommit = True
+
+    def _execute_batch(self, conn, cursor, run, rows, description):
+        """
+        Runs the body of _execute_transaction() on a connection which is not
+        in autocommit mode. Returns a list of the indices of failed rows.
+        """
+        failed = []
         try:
-            self._cursor.execute(sql, data)
-            return True
-        except psycopg2.IntegrityError:
-            # Should run in case of repeated UNIQUE table values
-            self._conn.rollback()
-            logging.exception('%s execute() sql=%s , data=%s' % (CLASS_NAME, sql, data))
-            
+            run(cursor, rows)
+            conn.commit()
+            return failed
         except:
-            self._conn.rollback()
-            logging.exception('%s execute() sql=%s , data=%s' % (CLASS_NAME, sql, data))
-        
+            conn.rollback()
+            logging.exception('%s execute_many() sql=%s , rows=%d',
+                                            CLASS_NAME, description, len(rows))
+
+        # Isolate the failing rows, keeping every other row of the batch
+        for index, row in enumerate(rows):
+            cursor.execute("SAVEPOINT %s" % BATCH_SAVEPOINT)
+            try:
+                run(cursor, [row])
+                cursor.execute("RELEASE SAVEPOINT %s" % BATCH_SAVEPOINT)
+            except psycopg2.Error:
+                cursor.execute("ROLLBACK TO SAVEPOINT %s" % BATCH_SAVEPOINT)
+                logging.error('%s execute_many() failed row %d: %s',
+                                                    CLASS_NAME, index, row)
+                failed.append(index)
+
+        conn.commit()
+        return failed
+
+    def copy_insert(self, staging_table, create_sql, copy_sql, data_file, insert_sql):
+        """
+        Loads rows with COPY into a temporary staging table and moves them
+        into their table with a single INSERT ... SELECT, inside one
+        transaction. The staging table is created once per connection and
+        must empty itself on commit. Returns a list of the rows returned by
+        insert_sql, empty if it has no RETURNING clause, or None if the
+        transaction failed.
+
+        staging_table (str): Name of the temporary staging table
+        create_sql (str): Statement creating the staging table
+        copy_sql (str): COPY ... FROM STDIN statement for the staging table
+        data_file (file): Rows in the format expected by copy_sql
+        insert_sql (str): Statement moving the staged rows into their table
+        """
+        with METRICS.timer('postgres_statement', statement='copy_insert'), \
+                                                self.connection() as conn:
+            try:
+                with _prepared_lock:
+                    created = staging_table in _staging_tables.get(conn, ())
+                if not created:
+                    with conn.cursor() as cursor:
+                        cursor.execute(create_sql)
+                    with _prepared_lock:
+                        _staging_tables.setdefault(conn, set()).add(staging_table)
+
+                conn.autocommit = False
+                with conn.cursor() as cursor:
+                    cursor.copy_expert(copy_sql, data_file)
+                    cursor.execute(insert_sql)
+                    inserted = []
+                    if cursor.description is not None:
+                        inserted = cursor.fetchall()
+                conn.commit()
+                return inserted
+            except:
+                conn.rollback()
+                logging.exception('%s copy_insert() sql=%s', CLASS_NAME, copy_sql)
+            finally:
+                conn.autocommit = True
+
+        METRICS.increment('postgres_statement_errors', statement='copy_insert')
+        return None
+
+    def _prepare(self, conn, name):
+        """
+        Makes sure the named statement is prepared on a connection in
+        autocommit mode, preparing it on first use. Hits and misses are
+        counted in METRICS.
+
+        conn (psycopg2.extensions.connection): Connection to prepare it on
+        name (str): Key of PREPARED_STATEMENTS
+        """
+        with _prepared_lock:
+            prepared = _prepared.setdefault(conn, set())
+            if name in prepared:
+                METRICS.increment('prepared_statement_hits', statement=name)
+                return
+
+        with conn.cursor() as cursor:
+            try:
+                cursor.execute("PREPARE %s AS %s" % (name, self.PREPARED_STATEMENTS[name]))
+            except psycopg2.errors.DuplicatePreparedStatement:
+                # Prepared on this session by code which bypassed the cache
+                pass
+
+        with _prepared_lock:
+            prepared.add(name)
+        METRICS.increment('prepared_statement_misses', statement=name)
+
+    def _forget_prepared(self, conn, name):
+        """
+        Forgets that a statement is prepared on a connection, such as after
+        the session discarded it, so that it is prepared again.
+        """
+        with _prepared_lock:
+            _prepared.get(conn, set()).discard(name)
+
+    def _run_prepared(self, conn, name, run):
+        """
+        Prepares the named statement if needed and calls run(). If the
+        session no longer knows the statement, it is prepared again and
+        run() is called once more.
+        """
+        self._prepare(conn, name)
+        try:
+            return run()
+        except psycopg2.errors.InvalidSqlStatementName:
+            if not conn.autocommit:
+                conn.rollback()
+            self._forget_prepared(conn, name)
+            self._prepare(conn, name)
+            return run()
+
+    @staticmethod
+    def _execute_sql(name, parameter_count):
+        """
+        Returns the EXECUTE statement for a prepared statement with the given
+        number of parameters.
+        """
+        if not parameter_count:
+            return "EXECUTE %s" % name
+        return "EXECUTE %s (%s)" % (name, ', '.join(['%s'] * parameter_count))
+
+    def select_prepared(self, name, data=()):
+        """
+        Returns all rows from a prepared statement, like select().
+
+        name (str): Key of PREPARED_STATEMENTS
+        data (tuple): [OPTIONAL] Values of the parameters of the statement
+        """
+        sql = self._execute_sql(name, len(data))
+
+        with METRICS.timer('postgres_statement', statement=name), \
+                                                self.connection() as conn:
+            def run():
+                with conn.cursor() as cursor:
+                    cursor.execute(sql, data)
+                    return cursor.fetchall()
+
+            return self._run_prepared(conn, name, run)
+
+    def execute_prepared(self, name, data=()):
+        """
+        Executes a prepared statement, like execute(). Returns True if it
+        succeeded.
+
+        name (str): Key of PREPARED_STATEMENTS
+        data (tuple): [OPTIONAL] Values of the parameters of the statement
+        """
+        sql = self._execute_sql(name, len(data))
+
+        with METRICS.timer('postgres_statement', statement=name), \
+                                                self.connection() as conn:
+            def run():
+                with conn.cursor() as cursor:
+                    cursor.execute(sql, data)
+
+            try:
+                self._run_prepared(conn, name, run)
+                return True
+            except:
+                logging.exception('%s execute_prepared() name=%s , data=%s',
+                                                            CLASS_NAME, name, data)
+
+        METRICS.increment('postgres_statement_errors', statement=name)
         return False
+
+    def execute_many_prepared(self, name, rows):
+        """
+        Executes a prepared statement for many rows inside a single
+        transaction, like execute_many(). The EXECUTE statements are sent
+        together in as few round trips as possible. Returns a list of the
+        indices of rows which could not be executed.
+
+        name (str): Key of PREPARED_STATEMENTS
+        rows (list): Tuples of parameter values, one tuple per row
+        """
+        failed = []
+        if not rows:
+            return failed
+
+        sql = self._execute_sql(name, len(rows[0]))
+
+        with METRICS.timer('postgres_statement', statement=name), \
+                                                self.connection() as conn:
+            def run(cursor, batch):
+                try:
+                    psycopg2.extras.execute_batch(cursor, sql, batch,
+                                                            page_size=len(batch))
+                except psycopg2.errors.InvalidSqlStatementName:
+                    self._forget_prepared(conn, name)
+                    raise
+
+            self._prepare(conn, name)
+            failed = self._execute_transaction(conn, run, rows, name)
+            if len(failed) == len(rows) and name not in _prepared.get(conn, ()):
+                # The session lost the statement during the transaction
+                self._prepare(conn, name)
+                failed = self._execute_transaction(conn, run, rows, name)
+
+        if failed:
+            METRICS.increment('postgres_failed_rows', len(failed), statement=name)
+        return failed
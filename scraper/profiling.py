@@ -0,0 +1,198 @@
+"""
+This module features the IterationProfiler() class. When enabled, it runs
+cProfile over every Nth iteration of the scraper, dumping each profile to a
+.pstats file, and compares tracemalloc snapshots between those iterations,
+logging the functions which took the most time and the lines whose memory
+grew the most. Work done for the iteration in other threads is profiled
+through profile_section() and merged into the same profile.
+"""
+
+import cProfile
+import io
+import logging
+import os
+import pstats
+import sys
+import threading
+import tracemalloc
+from contextlib import contextmanager
+
+CLASS_NAME = "scraper.IterationProfiler: "
+PROFILE_ENVIRONMENT_VARIABLE = 'SCRAPER_PROFILE_EVERY'
+DEFAULT_DIRECTORY = 'profiles'
+DEFAULT_TOP = 15
+TRACEBACK_FRAMES = 10
+PROFILE_FILE = 'iteration-%d-%06d.pstats'
+# From Python 3.12 cProfile is built on sys.monitoring, so a profile sees
+# every thread and only one profile can be enabled at a time
+PROFILES_EVERY_THREAD = sys.version_info >= (3, 12)
+
+# Profiler of the iteration being profiled, used by profile_section()
+_active_profiler = None
+
+
+def profile_every_from_environment():
+    """
+    Returns the profiling interval set in the SCRAPER_PROFILE_EVERY
+    environment variable, or 0 if it is not set or not a number.
+    """
+    try:
+        return int(os.environ.get(PROFILE_ENVIRONMENT_VARIABLE, 0))
+    except ValueError:
+        logging.error("%s %s is not a number", CLASS_NAME, PROFILE_ENVIRONMENT_VARIABLE)
+        return 0
+
+
+@contextmanager
+def profile_section():
+    """
+    Context manager wrapped around work which runs outside the thread of the
+    iteration, such as requests in executor threads or writes in the
+    DatabaseWriter thread. While an iteration is profiled, the work is
+    profiled too and merged into its profile; otherwise it does nothing.
+    """
+    profiler = _active_profiler
+    if profiler is None:
+        yield
+        return
+
+    with profiler.section():
+        yield
+
+
+class IterationProfiler(object):
+
+    def __init__(self, every=0, directory=DEFAULT_DIRECTORY, top=DEFAULT_TOP):
+        """
+        Initializes the profiler. Nothing is profiled if every is 0.
+
+        every (int): [OPTIONAL] Profile one iteration out of this many
+        directory (str): [OPTIONAL] Directory the .pstats files are written to
+        top (int): [OPTIONAL] Number of offenders logged
+        """
+        self.every = every
+        self._directory = directory
+        self._top = top
+        self._snapshot = None
+
+        # Profiles of the sections run in other threads, see section()
+        self._thread = None
+        self._section_profiles = []
+        self._lock = threading.Lock()
+
+        if self.every:
+            os.makedirs(self._directory, exist_ok=True)
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(TRACEBACK_FRAMES)
+
+    @contextmanager
+    def iteration(self, index):
+        """
+        Context manager wrapped around the body of an iteration. Iterations
+        whose index is a multiple of every are profiled. Before Python 3.12
+        cProfile only sees the calling thread, so the work of other threads
+        is only included where it is wrapped in profile_section(). Failures
+        of the profiler are logged and never raised into the iteration.
+
+        index (int): Index of the iteration
+        """
+        global _active_profiler
+
+        if not self.every or index % self.every:
+            yield
+            return
+
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            logging.exception('%s iteration() index=%d', CLASS_NAME, index)
+            yield
+            return
+
+        if not PROFILES_EVERY_THREAD:
+            with self._lock:
+                self._thread = threading.get_ident()
+                self._section_profiles = []
+            _active_profiler = self
+
+        try:
+            yield
+        finally:
+            profile.disable()
+            _active_profiler = None
+            with self._lock:
+                self._thread = None
+                section_profiles = self._section_profiles
+                self._section_profiles = []
+
+            try:
+                self._report(index, profile, section_profiles)
+            except:
+                logging.exception('%s _report() index=%d', CLASS_NAME, index)
+
+    @contextmanager
+    def section(self):
+        """
+        Context manager which profiles the work it wraps in its own thread
+        while an iteration is profiled, see profile_section(). It does
+        nothing in the thread of the iteration, which is already profiled,
+        and from Python 3.12, where the iteration profile sees every thread.
+        If the profile cannot be enabled, the work is run unprofiled.
+        """
+        with self._lock:
+            if self._thread is None or self._thread == threading.get_ident():
+                profile = None
+            else:
+                profile = cProfile.Profile()
+                section_profiles = self._section_profiles
+
+        if profile is not None:
+            try:
+                profile.enable()
+            except ValueError:
+                logging.exception('%s section()', CLASS_NAME)
+                profile = None
+
+        if profile is None:
+            yield
+            return
+
+        try:
+            yield
+        finally:
+            profile.disable()
+            with self._lock:
+                section_profiles.append(profile)
+
+    def _report(self, index, profile, section_profiles):
+        """
+        Dumps the profile of an iteration, merged with the profiles of its
+        sections in other threads, and logs its top functions and the memory
+        growth since the previous profiled iteration.
+        """
+        path = os.path.join(self._directory, PROFILE_FILE % (os.getpid(), index))
+
+        output = io.StringIO()
+        stats = pstats.Stats(profile, stream=output)
+        for section_profile in section_profiles:
+            stats.add(section_profile)
+        stats.dump_stats(path)
+
+        stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(self._top)
+        logging.info("Iteration %d: Profile written to %s, %d sections from other "
+                        "threads merged\n%s", index, path, len(section_profiles),
+                                                            output.getvalue())
+
+        snapshot = tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+        ))
+        current, peak = tracemalloc.get_traced_memory()
+        if self._snapshot is not None:
+            differences = snapshot.compare_to(self._snapshot, 'lineno')
+            lines = [str(difference) for difference in differences[:self._top]]
+            logging.info("Iteration %d: Traced memory %.1f KiB, peak %.1f KiB, "
+                            "largest changes since the last profile:\n%s", index,
+                            current / 1024, peak / 1024, '\n'.join(lines))
+        self._snapshot = snapshot
@@ -0,0 +1,175 @@
+"""
+This module features the RateLimiter() class, which paces the requests made
+to the Sigfox API for one account. Requests are limited by a token bucket,
+and the number of requests in flight is adapted to the responses of the
+backend: it grows slowly while requests succeed quickly, and is halved when
+the backend throttles the account or slows down.
+"""
+
+import logging
+import threading
+import time
+
+from scraper.metrics import METRICS
+
+CLASS_NAME = "scraper.RateLimiter: "
+DEFAULT_RATE = 10.0
+DEFAULT_BURST = 20
+DEFAULT_MIN_CONCURRENCY = 1
+DEFAULT_MAX_CONCURRENCY = 16
+DEFAULT_INITIAL_CONCURRENCY = 4
+# Responses slower than this, in seconds, count as congestion
+DEFAULT_LATENCY_TARGET = 2.0
+ADDITIVE_INCREASE = 1.0
+MULTIPLICATIVE_DECREASE = 0.5
+
+# Rate limiters shared by every SigfoxScraper in the process, keyed by account
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+class RateLimiter(object):
+
+    def __init__(self, account=None, rate=DEFAULT_RATE, burst=DEFAULT_BURST,
+                    min_concurrency=DEFAULT_MIN_CONCURRENCY,
+                    max_concurrency=DEFAULT_MAX_CONCURRENCY,
+                    initial_concurrency=DEFAULT_INITIAL_CONCURRENCY,
+                    latency_target=DEFAULT_LATENCY_TARGET):
+        """
+        Initializes a limiter with a full token bucket.
+
+        account (str): [OPTIONAL] Account the limiter paces, used as a label
+        rate (float): [OPTIONAL] Requests allowed per second, or None for no
+        limit on the rate
+        burst (int): [OPTIONAL] Requests which may be made at once after an
+        idle period
+        min_concurrency (int): [OPTIONAL] Fewest requests allowed in flight
+        max_concurrency (int): [OPTIONAL] Most requests allowed in flight
+        initial_concurrency (int): [OPTIONAL] Requests allowed in flight at
+        the start
+        latency_target (float): [OPTIONAL] Seconds a response may take before
+        the concurrency is decreased
+        """
+        self.account = account
+        self._rate = rate
+        self._burst = burst
+        self._min_concurrency = min_concurrency
+        self._max_concurrency = max_concurrency
+        self._latency_target = latency_target
+
+        self._concurrency = float(min(max_concurrency, max(min_concurrency,
+                                                        initial_concurrency)))
+        self._in_flight = 0
+        self._tokens = float(burst)
+        self._refilled_at = time.monotonic()
+        self._paused_until = 0
+        self._decreased_at = 0
+        self._condition = threading.Condition()
+
+    @property
+    def concurrency(self):
+        """
+        Number of requests currently allowed in flight.
+        """
+        return int(self._concurrency)
+
+    def _refill(self, now):
+        if self._rate is not None:
+            elapsed = now - self._refilled_at
+            self._tokens = min(self._burst, self._tokens + elapsed * self._rate)
+        self._refilled_at = now
+
+    def acquire(self):
+        """
+        Waits until a request may be made and reserves a slot for it. Every
+        call must be followed by a call to release().
+        """
+        start = time.monotonic()
+        with self._condition:
+            while True:
+                now = time.monotonic()
+                self._refill(now)
+
+                if now < self._paused_until:
+                    wait = self._paused_until - now
+                elif self._in_flight >= int(self._concurrency):
+                    # Woken by release()
+                    wait = None
+                elif self._rate is not None and self._tokens < 1:
+                    wait = (1 - self._tokens) / self._rate
+                else:
+                    break
+
+                self._condition.wait(wait)
+
+            if self._rate is not None:
+                self._tokens -= 1
+            self._in_flight += 1
+
+        METRICS.observe('rate_limit_wait', time.monotonic() - start, account=self.account)
+
+    def release(self, latency=None, throttled=False, retry_after=None):
+        """
+        Frees the slot reserved by acquire() and adapts the concurrency to
+        the outcome of the request.
+
+        latency (float): [OPTIONAL] Seconds the request took, or None if it
+        failed without a response
+        throttled (bool): [OPTIONAL] True if the backend rejected the request
+        with 429 Too Many Requests
+        retry_after (float): [OPTIONAL] Seconds every request of the account
+        should wait before being made, such as after a 429 response
+        """
+        now = time.monotonic()
+        with self._condition:
+            self._in_flight -= 1
+
+            if retry_after:
+                self._paused_until = max(self._paused_until, now + retry_after)
+
+            if throttled:
+                METRICS.increment('rate_limit_throttled', account=self.account)
+                self._decrease(now, force=True)
+            elif latency is not None and latency > self._latency_target:
+                self._decrease(now)
+            elif latency is not None:
+                # Grows by about one request per round of requests in flight
+                self._concurrency = min(self._max_concurrency,
+                            self._concurrency + ADDITIVE_INCREASE / self._concurrency)
+
+            self._condition.notify_all()
+
+    def _decrease(self, now, force=False):
+        """
+        Multiplies the concurrency by MULTIPLICATIVE_DECREASE. Unless forced,
+        it is decreased at most once per latency target, so that a burst of
+        slow responses to requests made together counts only once.
+        """
+        if not force and now - self._decreased_at < self._latency_target:
+            return
+
+        self._decreased_at = now
+        concurrency = max(self._min_concurrency,
+                                self._concurrency * MULTIPLICATIVE_DECREASE)
+        if int(concurrency) != int(self._concurrency):
+            logging.debug("%s account=%s concurrency %d -> %d", CLASS_NAME,
+                        self.account, int(self._concurrency), int(concurrency))
+        self._concurrency = concurrency
+
+
+def get_rate_limiter(account, **kwargs):
+    """
+    Returns the process-wide rate limiter for an account, creating it with
+    the given arguments on first use, so that every scraper for the account
+    shares its limits.
+
+    account (str): Login identifier of the Sigfox account
+    kwargs: Arguments of RateLimiter(), used when it is created
+    """
+    with _limiters_lock:
+        limiter = _limiters.get(account)
+        if limiter is None:
+            limiter = RateLimiter(account, **kwargs)
+            _limiters[account] = limiter
+
+    return limiter
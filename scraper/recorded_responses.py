@@ -0,0 +1,107 @@
+"""
+This module reads Sigfox API responses recorded to disk, one JSON document
+per line, so that they can be replayed into the database without the API.
+Plain files are memory-mapped and gzip files are streamed. Each response is
+returned with the offset of the line after it, which can be saved as a
+checkpoint to resume from.
+"""
+
+import gzip
+import json
+import mmap
+import os
+
+GZIP_SUFFIX = '.gz'
+CHECKPOINT_SUFFIX = '.offset'
+NEWLINE = b'\n'
+
+DATA_KEY = 'data'
+DEVICE_KEY = 'device'
+RESPONSE_KEY = 'response'
+
+
+def iter_recorded_responses(path, offset=0):
+    """
+    Generator which yields (next_offset, response) for every line of a
+    recorded file, starting at the given offset. Blank lines are skipped.
+    The offsets of gzip files count uncompressed bytes.
+
+    path (str): Path of the file, ending in .gz if it is compressed
+    offset (int): [OPTIONAL] Offset to start reading at, as yielded before
+    """
+    if path.endswith(GZIP_SUFFIX):
+        with gzip.open(path, 'rb') as recorded:
+            recorded.seek(offset)
+            for line in recorded:
+                offset += len(line)
+                if line.strip():
+                    yield offset, json.loads(line)
+        return
+
+    with open(path, 'rb') as recorded:
+        if os.fstat(recorded.fileno()).st_size == 0:
+            return
+
+        with mmap.mmap(recorded.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            size = len(mapped)
+            while offset < size:
+                end = mapped.find(NEWLINE, offset)
+                if end == -1:
+                    end = size
+                line = mapped[offset:end]
+                offset = end + 1
+                if line.strip():
+                    yield min(offset, size), json.loads(line)
+
+def split_by_device(response):
+    """
+    Returns a list of (device, response) pairs, each response holding the
+    messages of a single device. A record may either wrap a response as
+    {"device": ..., "response": {...}}, or be a response as returned by the
+    API, whose messages name their device.
+
+    response (dict): Recorded record
+    """
+    if RESPONSE_KEY in response:
+        return [(response[DEVICE_KEY], response[RESPONSE_KEY])]
+
+    by_device = {}
+    for message in response.get(DATA_KEY, []):
+        by_device.setdefault(message[DEVICE_KEY], []).append(message)
+
+    return [(device, {DATA_KEY: messages}) for device, messages in by_device.items()]
+
+def checkpoint_path(path):
+    """
+    Returns the path of the checkpoint file of a recorded file.
+
+    path (str): Path of the recorded file
+    """
+    return path + CHECKPOINT_SUFFIX
+
+def read_checkpoint(path):
+    """
+    Returns the offset saved for a recorded file, or 0 if there is none.
+
+    path (str): Path of the recorded file
+    """
+    try:
+        with open(checkpoint_path(path)) as checkpoint:
+            return int(checkpoint.read().strip() or 0)
+    except FileNotFoundError:
+        return 0
+
+def write_checkpoint(path, offset):
+    """
+    Saves the offset of a recorded file. The file is replaced atomically, so
+    a crash leaves either the old or the new offset.
+
+    path (str): Path of the recorded file
+    offset (int): Offset to resume from
+    """
+    temporary = checkpoint_path(path) + '.tmp'
+    with open(temporary, 'w') as checkpoint:
+        checkpoint.write('%d\n' % offset)
+        checkpoint.flush()
+        os.fsync(checkpoint.fileno())
+    os.replace(temporary, checkpoint_path(path))
@@ -0,0 +1,171 @@
+"""
+This module features the SensorRollup() class. The class aggregates the
+decoded sensor values of stored messages per node and hour and per node and
+day, and adds them to the rollup tables with one upsert per table when it is
+flushed, so that trends can be read without decoding the message history.
+"""
+
+import logging
+import threading
+
+from scraper.message_parser import MessageParser
+
+HOUR = 60 * 60
+DAY = 24 * HOUR
+# Granularity to (table, seconds per period)
+ROLLUP_PERIODS = {
+    'hourly': ('sensor_rollup_hourly', HOUR),
+    'daily': ('sensor_rollup_daily', DAY),
+}
+
+COUNT_INDEX = 0
+BUTTON_PRESSES_INDEX = 1
+TEMPERATURE_COUNT_INDEX = 2
+TEMPERATURE_MIN_INDEX = 3
+TEMPERATURE_MAX_INDEX = 4
+TEMPERATURE_SUM_INDEX = 5
+VIBRATION_COUNT_INDEX = 6
+VIBRATION_MIN_INDEX = 7
+VIBRATION_MAX_INDEX = 8
+VIBRATION_SUM_INDEX = 9
+
+
+def new_aggregate():
+    """
+    Returns an empty aggregate: [count, button presses, temperature count,
+    min, max and sum, vibration count, min, max and sum].
+    """
+    return [0, 0, 0, None, None, 0, 0, None, None, 0.0]
+
+def merge_aggregates(aggregate, other):
+    """
+    Adds the values of one aggregate to another.
+
+    aggregate (list): Aggregate which is updated
+    other (list): Aggregate which is added
+    """
+    for count_index, min_index, max_index, sum_index in (
+                (TEMPERATURE_COUNT_INDEX, TEMPERATURE_MIN_INDEX,
+                        TEMPERATURE_MAX_INDEX, TEMPERATURE_SUM_INDEX),
+                (VIBRATION_COUNT_INDEX, VIBRATION_MIN_INDEX,
+                        VIBRATION_MAX_INDEX, VIBRATION_SUM_INDEX)):
+        if other[count_index]:
+            if aggregate[count_index]:
+                aggregate[min_index] = min(aggregate[min_index], other[min_index])
+                aggregate[max_index] = max(aggregate[max_index], other[max_index])
+            else:
+                aggregate[min_index] = other[min_index]
+                aggregate[max_index] = other[max_index]
+            aggregate[count_index] += other[count_index]
+            aggregate[sum_index] += other[sum_index]
+
+    aggregate[COUNT_INDEX] += other[COUNT_INDEX]
+    aggregate[BUTTON_PRESSES_INDEX] += other[BUTTON_PRESSES_INDEX]
+
+
+class SensorRollup(object):
+
+    def __init__(self, db):
+        """
+        Initializes an empty rollup for the given database.
+
+        db (scraper.PostgresInteraction): Connection to the database
+        """
+        self._db = db
+        self._message_parser = MessageParser()
+        # Granularity to {(node_id, period_start): aggregate}
+        self._pending = dict((granularity, {}) for granularity in ROLLUP_PERIODS)
+        self._lock = threading.Lock()
+
+    def add(self, batch):
+        """
+        Adds stored messages to the rollups. Nothing is written until
+        flush(). Messages which are not valid only count as messages.
+
+        batch (scraper.MessageBatch): Messages which have been stored
+        """
+        if not len(batch):
+            return
+
+        if batch.button_pressed is None:
+            self._message_parser.decode_batch(batch)
+
+        hourly = {}
+        for node_id, time_sent, button_pressed, temperature_sensed, temperature, \
+                        vibration_sensed, vibration in zip(batch.node_ids, batch.times,
+                            batch.button_pressed, batch.temperature_sensed,
+                            batch.temperatures, batch.vibration_sensed, batch.vibrations):
+            key = (node_id, time_sent - time_sent % HOUR)
+            aggregate = hourly.get(key)
+            if aggregate is None:
+                aggregate = hourly[key] = new_aggregate()
+
+            aggregate[COUNT_INDEX] += 1
+            if button_pressed == True:
+                aggregate[BUTTON_PRESSES_INDEX] += 1
+
+            if temperature_sensed == True:
+                if aggregate[TEMPERATURE_COUNT_INDEX]:
+                    aggregate[TEMPERATURE_MIN_INDEX] = min(aggregate[TEMPERATURE_MIN_INDEX], temperature)
+                    aggregate[TEMPERATURE_MAX_INDEX] = max(aggregate[TEMPERATURE_MAX_INDEX], temperature)
+                else:
+                    aggregate[TEMPERATURE_MIN_INDEX] = temperature
+                    aggregate[TEMPERATURE_MAX_INDEX] = temperature
+                aggregate[TEMPERATURE_COUNT_INDEX] += 1
+                aggregate[TEMPERATURE_SUM_INDEX] += temperature
+
+            if vibration_sensed == True:
+                if aggregate[VIBRATION_COUNT_INDEX]:
+                    aggregate[VIBRATION_MIN_INDEX] = min(aggregate[VIBRATION_MIN_INDEX], vibration)
+                    aggregate[VIBRATION_MAX_INDEX] = max(aggregate[VIBRATION_MAX_INDEX], vibration)
+                else:
+                    aggregate[VIBRATION_MIN_INDEX] = vibration
+                    aggregate[VIBRATION_MAX_INDEX] = vibration
+                aggregate[VIBRATION_COUNT_INDEX] += 1
+                aggregate[VIBRATION_SUM_INDEX] += vibration
+
+        with self._lock:
+            for granularity, (table, period) in ROLLUP_PERIODS.items():
+                pending = self._pending[granularity]
+                for (node_id, hour), aggregate in hourly.items():
+                    self._merge(pending, (node_id, hour - hour % period), aggregate)
+
+    @staticmethod
+    def _merge(pending, key, aggregate):
+        existing = pending.get(key)
+        if existing is None:
+            pending[key] = list(aggregate)
+        else:
+            merge_aggregates(existing, aggregate)
+
+    def pending(self):
+        """
+        Returns the number of (node, period) aggregates waiting to be written.
+        """
+        with self._lock:
+            return sum(len(pending) for pending in self._pending.values())
+
+    def flush(self):
+        """
+        Adds every pending aggregate to the rollup tables with one upsert per
+        table. Aggregates which could not be written are kept for the next
+        flush.
+        """
+        with self._lock:
+            pending = self._pending
+            self._pending = dict((granularity, {}) for granularity in ROLLUP_PERIODS)
+
+        for granularity, aggregates in pending.items():
+            rows = [key + tuple(aggregate) for key, aggregate in aggregates.items()]
+            try:
+                failed_rows = self._db.upsert_rollups(ROLLUP_PERIODS[granularity][0], rows)
+            except:
+                logging.exception("Rollups could not be written: %s", granularity)
+                failed_rows = rows
+            if not failed_rows:
+                continue
+
+            logging.error("Rollups could not be written: %s %d", granularity, len(failed_rows))
+            with self._lock:
+                for row in failed_rows:
+                    self._merge(self._pending[granularity], row[:2], row[2:])
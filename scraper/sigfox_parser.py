@@ -1,8 +1,13 @@
-import traceback
+import logging
+import string
+
+from scraper.message_batch import MessageBatch
+from scraper.metrics import METRICS
 
 DATA_KEY = 'data'
 TIME_KEY = 'time'
 ID_KEY = 'id'
+HEX_DIGITS = string.hexdigits
 
 class SigfoxParser(object):
 
@@ -60,6 +65,39 @@ class SigfoxParser(object):
         
         return list_of_messages
 
+    def retrieve_message_batch_from_response(self, device_messages_response,
+                                                since=None, node_id=0, batch=None):
+        """
+        Retrieves the messages from a Sigfox Device Messages response into a
+        MessageBatch, decoding each payload from hex. Returns the batch.
+
+        device_messages_response (dict): Response to a request for device
+        messages
+        since (int): [OPTIONAL] Messages sent at or before this time are
+        skipped
+        node_id (int): [OPTIONAL] ID of the node of the device, which can
+        also be set later with MessageBatch.assign_node_id()
+        batch (scraper.MessageBatch): [OPTIONAL] Batch the messages are
+        added to, such as the batch of the previous page
+        """
+        if batch is None:
+            batch = MessageBatch()
+
+        raw_messages = []
+        for message in device_messages_response[DATA_KEY]:
+            time_sent = message[TIME_KEY]
+            if since is not None and time_sent <= since:
+                continue
+
+            raw_messages.append(message[DATA_KEY])
+            batch.times.append(time_sent)
+
+        decoded, rejected = self.convert_messages_from_hex(raw_messages)
+        batch.raw.extend(raw_messages)
+        batch.messages.extend(decoded)
+        batch.assign_node_id(node_id)
+        return batch
+
     def convert_message_from_hex(self, hex_encoded_message):
         """
         Decodes a hexadecimal encoded message, decoded to standard str.
@@ -67,10 +105,84 @@ class SigfoxParser(object):
         hex_encoded_message (str): Hex encoded string to be decoded.
         If the message if not valid Hexadecimal, it is returned as is.
         """
+        decoded, rejected = self.convert_messages_from_hex([hex_encoded_message])
+        return decoded[0]
+
+    def convert_messages_from_hex(self, hex_encoded_messages):
+        """
+        Decodes a list of hexadecimal encoded messages at once, without
+        raising for malformed ones. Returns a tuple of the list of decoded
+        str messages and the list of the indices of rejected messages. A
+        message is rejected if it is not valid hexadecimal or not valid
+        UTF-8, and is returned as is, like convert_message_from_hex() does.
+        Rejected messages are counted in METRICS instead of being printed.
+
+        hex_encoded_messages (list): Hex encoded strings to be decoded
+        """
+        plain = []
+        other = []
+        for index, message in enumerate(hex_encoded_messages):
+            # A message made only of hex digits is stripped to nothing
+            if len(message) % 2 == 0 and not message.strip(HEX_DIGITS):
+                plain.append(index)
+            else:
+                other.append(index)
+
+        decoded = list(hex_encoded_messages)
+        rejected = []
+        if plain:
+            payloads = bytes.fromhex(''.join([hex_encoded_messages[index] for index in plain]))
+            if payloads.isascii():
+                # One byte per character, so every message is a slice
+                text = payloads.decode('ascii')
+                offset = 0
+                for index in plain:
+                    end = offset + len(hex_encoded_messages[index]) // 2
+                    decoded[index] = text[offset:end]
+                    offset = end
+            else:
+                offset = 0
+                for index in plain:
+                    end = offset + len(hex_encoded_messages[index]) // 2
+                    message = self._decode_payload(payloads[offset:end])
+                    offset = end
+
+                    if message is None:
+                        rejected.append(index)
+                    else:
+                        decoded[index] = message
+
+        # Rare messages such as hex separated by whitespace, which
+        # bytes.fromhex() accepts, are decoded one at a time
+        for index in other:
+            try:
+                payload = bytes.fromhex(hex_encoded_messages[index])
+            except ValueError:
+                rejected.append(index)
+                continue
+
+            message = self._decode_payload(payload)
+            if message is None:
+                rejected.append(index)
+            else:
+                decoded[index] = message
+        rejected.sort()
+
+        if rejected:
+            METRICS.increment('messages_rejected', len(rejected))
+            logging.debug("Invalid hex messages: %d, first: %s", len(rejected),
+                                                hex_encoded_messages[rejected[0]])
+
+        return decoded, rejected
+
+    @staticmethod
+    def _decode_payload(payload):
+        """
+        Returns the payload decoded as UTF-8, or None if it is not valid.
+
+        payload (bytes): Payload of a message
+        """
         try:
-            decoded = bytearray.fromhex(hex_encoded_message).decode()
-            return decoded
-        except ValueError:
-            traceback.print_exc()
-            print("Supposed Message: %s" % (hex_encoded_message))
-            return hex_encoded_message
+            return payload.decode('utf-8')
+        except UnicodeDecodeError:
+            return None
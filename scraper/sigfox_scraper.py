@@ -6,25 +6,69 @@ key data, including device type IDs, devices, and device messages.
 
 import requests
 import json
+import time
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
-DEVICE_TYPES_URL = "https://backend.sigfox.com/api/devicetypes/"
-DEVICES_OF_TYPE_URL = "https://backend.sigfox.com/api/devicetypes/%s/devices"
-DEVICE_INFO_URL = "https://backend.sigfox.com/api/devices/%s/"
-DEVICE_MESSAGES_URL = "https://backend.sigfox.com/api/devices/%s/messages/"
+from scraper.metrics import METRICS
+from scraper.rate_limiter import get_rate_limiter
+
+API_URL = "https://backend.sigfox.com/api/"
+DEVICE_TYPES_PATH = "devicetypes/"
+DEVICES_OF_TYPE_PATH = "devicetypes/%s/devices"
+DEVICE_INFO_PATH = "devices/%s/"
+DEVICE_MESSAGES_PATH = "devices/%s/messages/"
+
+DEVICE_TYPES_URL = API_URL + DEVICE_TYPES_PATH
+DEVICES_OF_TYPE_URL = API_URL + DEVICES_OF_TYPE_PATH
+DEVICE_INFO_URL = API_URL + DEVICE_INFO_PATH
+DEVICE_MESSAGES_URL = API_URL + DEVICE_MESSAGES_PATH
 
 DATA_KEY = 'data'
 ID_KEY = 'id'
+SINCE_KEY = 'since'
+TIME_KEY = 'time'
+PAGING_KEY = 'paging'
+NEXT_KEY = 'next'
+ETAG_HEADER = 'ETag'
+LAST_MODIFIED_HEADER = 'Last-Modified'
+IF_NONE_MATCH_HEADER = 'If-None-Match'
+IF_MODIFIED_SINCE_HEADER = 'If-Modified-Since'
+RETRY_AFTER_HEADER = 'Retry-After'
+NOT_MODIFIED = 304
+TOO_MANY_REQUESTS = 429
+
+DEFAULT_POOL_SIZE = 10
+CONNECT_TIMEOUT = 5
+READ_TIMEOUT = 30
+DEFAULT_RETRIES = 3
+DEFAULT_BACKOFF_FACTOR = 0.5
+# 429 is retried by _get() instead, so that the rate limiter sees it
+RETRY_STATUS_CODES = (500, 502, 503, 504)
 
 
 class SigfoxScraper(object):
 
-    def __init__(self, username=None, password=None):
+    def __init__(self, username=None, password=None, pool_size=DEFAULT_POOL_SIZE,
+                    timeout=(CONNECT_TIMEOUT, READ_TIMEOUT), retries=DEFAULT_RETRIES,
+                    backoff_factor=DEFAULT_BACKOFF_FACTOR, api_url=API_URL,
+                    rate_limiter=None):
         """
         Initializes an instance of SigfoxScraper. If login details are given,
-        they will be stored for use in the requests later. 
+        they will be stored for use in the requests later. Each instance
+        keeps its own session, so connections to the API are kept alive and
+        reused between requests.
 
         username (str): [OPTIONAL] Login identifier to access the Sigfox API
         password (str): [OPTIONAL] Login password to access the Sigfox API
+        pool_size (int): [OPTIONAL] Number of connections kept open to the API
+        timeout (tuple): [OPTIONAL] Connect and read timeouts in seconds
+        retries (int): [OPTIONAL] Times a failed request is retried
+        backoff_factor (float): [OPTIONAL] Base of the exponential delay
+        between retries, in seconds
+        api_url (str): [OPTIONAL] Base URL of the Sigfox API, ending in /
+        rate_limiter (scraper.RateLimiter): [OPTIONAL] Paces the requests.
+        Defaults to the limiter shared by every scraper for the account
         """
         if username:
             self._login = username
@@ -36,46 +80,209 @@ class SigfoxScraper(object):
         else:
             self._password = None
 
+        self.api_url = api_url
+        self._timeout = timeout
+        self._retries = retries
+        self._backoff_factor = backoff_factor
+        if rate_limiter is None:
+            rate_limiter = get_rate_limiter(self._login)
+        self.rate_limiter = rate_limiter
+        self._session = requests.Session()
+        self._session.auth = (self._login, self._password)
+
+        retry = Retry(total=retries, backoff_factor=backoff_factor,
+                        status_forcelist=RETRY_STATUS_CODES,
+                        allowed_methods=frozenset(['GET']),
+                        respect_retry_after_header=True)
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size,
+                                                            max_retries=retry)
+        self._session.mount('https://', adapter)
+        self._session.mount('http://', adapter)
+
+    def _get(self, url, params=None, headers=None):
+        """
+        Performs a GET request through the session of this instance and
+        returns the response. Every request waits for the rate limiter of the
+        account. Requests which fail with 429 or 5xx are retried with
+        exponential backoff before an error is raised.
+
+        url (str): URL to request
+        params (dict): [OPTIONAL] Parameters to add to the request
+        headers (dict): [OPTIONAL] Extra headers to send with the request
+        """
+        for attempt in range(self._retries + 1):
+            self.rate_limiter.acquire()
+            start = time.monotonic()
+            latency = None
+            throttled = False
+            retry_after = None
+            try:
+                response = self._session.get(url, params=params, headers=headers,
+                                                        timeout=self._timeout)
+                latency = time.monotonic() - start
+                throttled = response.status_code == TOO_MANY_REQUESTS
+                if throttled:
+                    retry_after = self._retry_after(response, attempt)
+            finally:
+                self.rate_limiter.release(latency, throttled, retry_after)
+
+            if not throttled:
+                break
+
+        response.raise_for_status()
+        return response
+
+    def _retry_after(self, response, attempt):
+        """
+        Returns the number of seconds to wait after a 429 response: the
+        Retry-After header if it gives a number of seconds, otherwise the
+        exponential backoff for the attempt.
+        """
+        try:
+            return float(response.headers[RETRY_AFTER_HEADER])
+        except (KeyError, ValueError):
+            return self._backoff_factor * (2 ** attempt)
+
+    @property
+    def account(self):
+        """
+        Login identifier of the account this instance makes requests for.
+        """
+        return self._login
+
+    def close(self):
+        """
+        Closes the connections held by the session of this instance.
+        """
+        self._session.close()
+
+    @METRICS.timed('sigfox_request', request='request_device_types')
     def request_device_types(self): 
         """
         Returns in dict format, the device type IDs from the sigfox network
         for the registered user. 
         """
-        url = DEVICE_TYPES_URL
-        response = requests.get(url, auth=(self._login, self._password))
+        url = self.api_url + DEVICE_TYPES_PATH
+        response = self._get(url)
         device_types = response.text
         device_types = json.loads(device_types)
 
         return device_types
 
+    @METRICS.timed('sigfox_request', request='request_devices')
     def request_devices(self, device_type_id):
         """
         Returns in dict format, the devices for a given device type id. 
 
         device_type_id (str): Device type ID as registered to Sigfox
         """
-        url = DEVICES_OF_TYPE_URL % device_type_id
-        response = requests.get(url, auth=(self._login, self._password))
+        url = self.api_url + DEVICES_OF_TYPE_PATH % device_type_id
+        response = self._get(url)
         devices = response.text
         devices = json.loads(devices)
 
         return devices
 
-    def request_device_messages(self, device_id, payload=None):
+    @METRICS.timed('sigfox_request', request='request_device_messages')
+    def request_device_messages(self, device_id, payload=None, since=None):
         """
         Returns in dict format, the response from the sigfox network when 
         requesting messages for a given device ID.
 
         device_id (str): Device ID as registered to Sigfox
         payload (dict): [OPTIONAL] Parameters to add to the request
+        since (int): [OPTIONAL] Seconds since unix epoch. Only messages sent
+        after this time are requested
         """
-        url = DEVICE_MESSAGES_URL % (device_id)
-        response = requests.get(url, auth=(self._login, self._password),
-                                params=payload)
+        url = self.api_url + DEVICE_MESSAGES_PATH % (device_id)
+        if since is not None:
+            payload = dict(payload or {})
+            payload[SINCE_KEY] = since
+
+        response = self._get(url, params=payload)
         messages = response.text
         messages = json.loads(messages)
         return messages
     
+    @METRICS.timed('sigfox_request', request='request_url')
+    def request_url(self, url):
+        """
+        Returns in dict format, the response from the sigfox network for a
+        full URL, such as the next page link of a paginated response.
+
+        url (str): URL given by the Sigfox API
+        """
+        response = self._get(url)
+        page = response.text
+        page = json.loads(page)
+        return page
+
+    @METRICS.timed('sigfox_request', request='request_if_modified')
+    def request_if_modified(self, url, etag=None, last_modified=None):
+        """
+        Performs a conditional request for a URL. Returns a tuple of the
+        response in dict format, or None if the backend reports it has not
+        been modified, followed by the ETag and Last-Modified values to send
+        with the next request.
+
+        url (str): URL to request
+        etag (str): [OPTIONAL] ETag returned by the previous request
+        last_modified (str): [OPTIONAL] Last-Modified returned by the
+        previous request
+        """
+        headers = {}
+        if etag:
+            headers[IF_NONE_MATCH_HEADER] = etag
+        if last_modified:
+            headers[IF_MODIFIED_SINCE_HEADER] = last_modified
+
+        response = self._get(url, headers=headers)
+        if response.status_code == NOT_MODIFIED:
+            return (None, etag, last_modified)
+
+        data = json.loads(response.text)
+        return (data, response.headers.get(ETAG_HEADER),
+                            response.headers.get(LAST_MODIFIED_HEADER))
+
+    def iter_device_message_pages(self, device_id, since=None):
+        """
+        Generator which yields each page of messages for a given device ID,
+        newest first, in dict format. The next page is only requested once
+        the previous one has been consumed.
+
+        device_id (str): Device ID as registered to Sigfox
+        since (int): [OPTIONAL] Seconds since unix epoch. Only messages sent
+        after this time are requested
+        """
+        page = self.request_device_messages(device_id, None, since)
+        while True:
+            yield page
+
+            messages = page.get(DATA_KEY)
+            if not messages:
+                break
+            if since is not None and messages[-1][TIME_KEY] <= since:
+                # Every message after this page has already been requested
+                break
+
+            next_url = page.get(PAGING_KEY, {}).get(NEXT_KEY)
+            if not next_url:
+                break
+            page = self.request_url(next_url)
+
+    def iter_device_messages(self, device_id, since=None):
+        """
+        Generator which yields (data, time) tuples for every message of a
+        given device ID, newest first, following the pages of the response.
+
+        device_id (str): Device ID as registered to Sigfox
+        since (int): [OPTIONAL] Seconds since unix epoch. Only messages sent
+        after this time are requested
+        """
+        for page in self.iter_device_message_pages(device_id, since):
+            for message in page[DATA_KEY]:
+                yield (message[DATA_KEY], message[TIME_KEY])
+
     def store_authorisation_details(self, username, password):
         """
         Stores login details of the user in the class. 
@@ -85,6 +292,7 @@ class SigfoxScraper(object):
         """
         self._login = username
         self._password = password
+        self._session.auth = (self._login, self._password)
 
     def print_response(self, response):
         """
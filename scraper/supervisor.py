@@ -0,0 +1,209 @@
+"""
+This module features the Supervisor() class, which runs scraper workers in
+separate processes, and the PartitionClaims() class, which lets each worker
+claim partitions of the devices of each account with Postgres advisory locks.
+Workers on any number of hosts can share the same database without polling a
+device twice, and partitions held by a worker which dies are taken over by
+another worker.
+"""
+
+import logging
+import multiprocessing
+import time
+import zlib
+
+CLASS_NAME = "scraper.Supervisor: "
+# Seconds a worker leaves the partitions of other workers unclaimed after it
+# starts, so that every worker can claim its own partitions first
+CLAIM_GRACE = 60
+RESPAWN_INTERVAL = 5
+LOCK_NAMESPACE = 'sigfox_scraper:'
+
+
+def partition_of(device, partition_count):
+    """
+    Returns the partition a device belongs to. The hash is stable between
+    processes and hosts.
+
+    device (str): Sigfox ID of the device
+    partition_count (int): Number of partitions of each account
+    """
+    return zlib.crc32(device.encode()) % partition_count
+
+def partition_lock_key(account, partition):
+    """
+    Returns the pair of int keys of the advisory lock for a partition.
+
+    account (str): Login identifier of the Sigfox account
+    partition (int): Index of the partition
+    """
+    key = zlib.crc32((LOCK_NAMESPACE + account).encode())
+    # Postgres takes signed 32 bit keys
+    if key >= 2 ** 31:
+        key -= 2 ** 32
+    return (key, partition)
+
+def assign_partitions(units, process_count):
+    """
+    Splits (account, partition) units between workers, returning a list of
+    the units each worker should claim first.
+
+    units (list): Every (account, partition) tuple
+    process_count (int): Number of workers
+    """
+    return [units[index::process_count] for index in range(process_count)]
+
+
+class PartitionClaims(object):
+
+    def __init__(self, db, units, preferred, partition_count, grace=CLAIM_GRACE):
+        """
+        Initializes the claims of a worker. The advisory locks belong to the
+        session of db, so it must be a connection which is not pooled and is
+        kept open while the worker runs.
+
+        db (scraper.PostgresInteraction): Dedicated connection for the locks
+        units (list): Every (account, partition) tuple
+        preferred (list): Units this worker should claim first
+        partition_count (int): Number of partitions of each account
+        grace (float): [OPTIONAL] Seconds before other units are claimed
+        """
+        self._db = db
+        self._units = list(units)
+        self._preferred = set(preferred)
+        self._partition_count = partition_count
+        self._grace = grace
+        self._started_at = time.monotonic()
+        self._held = set()
+
+    def claim(self):
+        """
+        Confirms that the units held by this worker are still locked, then
+        tries to lock every unit not yet held, starting with its preferred
+        units. Returns the set of units held.
+
+        If the lock connection fails, Postgres has released the locks of its
+        session, so every unit is dropped and the connection is opened again
+        before the error is raised. The units are claimed again on the next
+        call.
+        """
+        try:
+            self._confirm()
+
+            claim_others = time.monotonic() - self._started_at >= self._grace
+            for unit in self._units:
+                if unit in self._held:
+                    continue
+                if unit not in self._preferred and not claim_others:
+                    continue
+
+                if self._db.try_advisory_lock(*partition_lock_key(*unit)):
+                    logging.info("%s claimed partition %s", CLASS_NAME, unit)
+                    self._held.add(unit)
+        except:
+            if self._held:
+                logging.warning("%s lock connection failed, dropping partitions %s",
+                                                        CLASS_NAME, sorted(self._held))
+            self._held.clear()
+            self._db.reconnect()
+            raise
+
+        return set(self._held)
+
+    def _confirm(self):
+        """
+        Drops the units whose advisory locks this worker no longer holds.
+        """
+        if not self._held:
+            return
+
+        locks = self._db.retrieve_advisory_locks()
+        for unit in list(self._held):
+            if partition_lock_key(*unit) not in locks:
+                logging.warning("%s lost partition %s", CLASS_NAME, unit)
+                self._held.discard(unit)
+
+    def device_filter(self, account):
+        """
+        Returns a function which is True for the devices of the account in
+        the partitions held by this worker.
+
+        account (str): Login identifier of the Sigfox account
+        """
+        def is_claimed(device):
+            return (account, partition_of(device, self._partition_count)) in self._held
+        return is_claimed
+
+    def release(self):
+        """
+        Releases every unit held by this worker.
+        """
+        for unit in self._held:
+            self._db.advisory_unlock(*partition_lock_key(*unit))
+        self._held.clear()
+
+
+class Supervisor(object):
+
+    def __init__(self, target, process_count, units, args=()):
+        """
+        Initializes a supervisor of process_count workers. Each worker runs
+        target(worker_index, preferred_units, *args).
+
+        target (function): Function run by each worker process
+        process_count (int): Number of workers
+        units (list): Every (account, partition) tuple
+        args (tuple): [OPTIONAL] Further arguments for target
+        """
+        self._target = target
+        self._assignments = assign_partitions(list(units), process_count)
+        self._args = tuple(args)
+        self._processes = [None] * process_count
+
+    def _spawn(self, index):
+        """
+        Starts the worker with the given index.
+        """
+        process = multiprocessing.Process(target=self._target, name='scraper-worker-%d' % index,
+                                args=(index, self._assignments[index]) + self._args)
+        process.start()
+        self._processes[index] = process
+        logging.info("%s started worker %d, pid %d", CLASS_NAME, index, process.pid)
+
+    def run(self, interval=RESPAWN_INTERVAL):
+        """
+        Starts every worker and restarts workers which die, until every worker
+        has exited successfully.
+
+        interval (float): [OPTIONAL] Seconds between checks of the workers
+        """
+        for index in range(len(self._processes)):
+            self._spawn(index)
+
+        try:
+            while any(process is not None for process in self._processes):
+                time.sleep(interval)
+                for index, process in enumerate(self._processes):
+                    if process is None or process.is_alive():
+                        continue
+
+                    if process.exitcode == 0:
+                        logging.info("%s worker %d finished", CLASS_NAME, index)
+                        self._processes[index] = None
+                    else:
+                        logging.error("%s worker %d died with exit code %s", 
+                                                    CLASS_NAME, index, process.exitcode)
+                        self._spawn(index)
+        finally:
+            self.stop()
+
+    def stop(self):
+        """
+        Terminates every worker which is still running.
+        """
+        for process in self._processes:
+            if process is not None and process.is_alive():
+                process.terminate()
+        for process in self._processes:
+            if process is not None:
+                process.join()